@@ -4,7 +4,11 @@
  • Preserves existing upload → annotate workflow.
  • Adds JSON metadata ingestion via the *notes* field.
  • Updates/creates Image, Icon, IconImage and IconInscription records when
-   valid JSON is detected.
+   valid JSON is detected. Icons are upserted on a natural key and their
+   images/inscriptions merged rather than duplicated.
+ • Records Image/GestureInstance changes in the change_events outbox for
+   the report backend's live feed.
+ • Exposes the streaming training-dataset export (dataset_export.py).
  • Uses the legacy global ``db_session`` for continuity; refactor to context
    managers later if desired.
  • British English comments, no emojis.
@@ -14,20 +18,68 @@ from __future__ import annotations
 
 import json
 import os
+import threading
 from pathlib import Path
 from typing import Any, Dict, List
 
 from flask import Flask, jsonify, request, send_from_directory
+from PIL import Image as PILImage
 from flask_cors import CORS
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from werkzeug.utils import secure_filename
 
-from models import SessionLocal, Image, GestureInstance, Gesture, Icon, IconImage, IconInscription
-
-from utils import save_crop
-
+from models import (
+    SessionLocal,
+    Image,
+    GestureInstance,
+    Gesture,
+    Icon,
+    IconImage,
+    IconInscription,
+    get_session,
+)
+
+import change_feed
+import dataset_export
+from phash_index import PHashIndex
+from utils import (
+    LRUCache,
+    box_iou,
+    dhash,
+    icon_content_key,
+    icon_natural_key,
+    inscription_key,
+    normalise_region,
+    save_crop,
+)
+
+change_feed.register(SessionLocal)
 db_session = SessionLocal()
 
+# natural key -> _CachedIcon for recently resolved icons. Entries assume this
+# process makes all icon writes; restart after running merge_duplicate_icons.py.
+_icon_cache = LRUCache(maxsize=512)
+
+# Icon columns that may be supplied through the metadata JSON
+ICON_FIELDS = (
+    "iconographic_variant_id",
+    "title",
+    "object_type",
+    "museum_collection_number",
+    "culture_period",
+    "date_approx",
+    "place_of_creation",
+    "current_location",
+    "acquisition_method",
+    "acquisition_source",
+    "acquisition_date",
+    "materials",
+    "techniques",
+    "dimensions_mm",
+    "image_url",
+    "condition_report",
+)
+
 # ---------------------------------------------------------------------------
 # Flask app initialisation
 # ---------------------------------------------------------------------------
@@ -40,6 +92,67 @@ CROPS_FOLDER = ROOT_DIR / "gesture_instance_crops"
 UPLOAD_FOLDER.mkdir(exist_ok=True)
 CROPS_FOLDER.mkdir(exist_ok=True)
 
+# ---------------------------------------------------------------------------
+# Near-duplicate scan detection
+# ---------------------------------------------------------------------------
+# Re-encoded or rescaled copies typically land within a few bits. Up to 7 the
+# index probes one flipped bit per 16-bit chunk; 8-11 costs ~8x more per query.
+PHASH_MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", "7"))
+
+
+def _load_image_hashes():
+    with get_session() as session:
+        return (
+            session.query(Image.id, Image.perceptual_hash)
+            .filter(Image.perceptual_hash.isnot(None))
+            .all()
+        )
+
+
+phash_index = PHashIndex(_load_image_hashes)
+
+# ---------------------------------------------------------------------------
+# Region overlap queries
+# ---------------------------------------------------------------------------
+OVERLAP_MIN_IOU = float(os.environ.get("OVERLAP_MIN_IOU", "0.7"))
+
+
+def _overlapping_instances(
+    image_id: int, box: tuple, min_iou: float = 0.0
+) -> List[Dict[str, Any]]:
+    """Return instances on *image_id* whose box intersects *box*.
+
+    The indexed box columns narrow the candidates in SQL; IoU is then computed
+    for the few that remain. Results are ordered by IoU, highest first.
+    """
+    x0, y0, x1, y1 = box
+    candidates = (
+        db_session.query(GestureInstance)
+        .filter(
+            GestureInstance.image_id == image_id,
+            GestureInstance.box_x0 < x1,
+            GestureInstance.box_x1 > x0,
+            GestureInstance.box_y0 < y1,
+            GestureInstance.box_y1 > y0,
+        )
+        .all()
+    )
+    matches = []
+    for inst in candidates:
+        iou = box_iou(box, (inst.box_x0, inst.box_y0, inst.box_x1, inst.box_y1))
+        if iou > 0 and iou >= min_iou:
+            matches.append(
+                {
+                    "gesture_instance_id": inst.id,
+                    "gesture_id": inst.gesture_id,
+                    "region_coordinates": inst.region_coordinates,
+                    "iou": round(iou, 4),
+                }
+            )
+    matches.sort(key=lambda m: m["iou"], reverse=True)
+    return matches
+
+
 # ---------------------------------------------------------------------------
 # Helper – process pasted metadata JSON from the notes field
 # ---------------------------------------------------------------------------
@@ -63,31 +176,11 @@ def _process_metadata(meta: Dict[str, Any], image: Image) -> None:  # noqa: D401
         db_session.flush()
         return  # nothing further to do
 
-    # Create Icon record
-    icon = Icon(
-        iconographic_variant_id=icon_meta.get("iconographic_variant_id"),
-        title=icon_meta.get("title"),
-        object_type=icon_meta.get("object_type", "icon"),
-        museum_collection_number=icon_meta.get("museum_collection_number"),
-        culture_period=icon_meta.get("culture_period"),
-        date_approx=icon_meta.get("date_approx"),
-        place_of_creation=icon_meta.get("place_of_creation"),
-        current_location=icon_meta.get("current_location"),
-        acquisition_method=icon_meta.get("acquisition_method"),
-        acquisition_source=icon_meta.get("acquisition_source"),
-        acquisition_date=icon_meta.get("acquisition_date"),
-        materials=icon_meta.get("materials"),
-        techniques=icon_meta.get("techniques"),
-        dimensions_mm=icon_meta.get("dimensions_mm"),
-        image_url=icon_meta.get("image_url"),
-        condition_report=icon_meta.get("condition_report"),
-    )
-    db_session.add(icon)
-    db_session.flush()  # obtain icon.id
+    icon = _upsert_icon(icon_meta)
 
     # ------------------------- Single icon image -------------------------
     icon_image_meta = meta.get("icon_image")
-    if icon_image_meta:
+    if icon_image_meta and icon_image_meta.get("image_url") not in icon.image_urls:
         db_session.add(
             IconImage(
                 icon_id=icon.id,
@@ -99,23 +192,117 @@ def _process_metadata(meta: Dict[str, Any], image: Image) -> None:  # noqa: D401
                 lighting_notes=icon_image_meta.get("lighting_notes"),
             )
         )
+        icon.image_urls.add(icon_image_meta.get("image_url"))
 
     # ------------------------ Icon inscriptions --------------------------
     inscriptions_meta: List[Dict[str, Any]] = meta.get("icon_inscriptions", [])
     for ins in inscriptions_meta:
-        db_session.add(
-            IconInscription(
-                icon_id=icon.id,
-                language=ins.get("language"),
-                text=ins.get("text"),
-                location_on_icon=ins.get("location_on_icon"),
-                script_type=ins.get("script_type"),
-                translation=ins.get("translation"),
-            )
+        inscription = IconInscription(
+            icon_id=icon.id,
+            language=ins.get("language"),
+            text=ins.get("text"),
+            location_on_icon=ins.get("location_on_icon"),
+            script_type=ins.get("script_type"),
+            translation=ins.get("translation"),
         )
+        key = inscription_key(inscription)
+        if key in icon.inscriptions:
+            continue  # already recorded against this icon
+        icon.inscriptions.add(key)
+        db_session.add(inscription)
 
     db_session.flush()
 
+
+class _CachedIcon:
+    """What ``_process_metadata`` needs to know about a resolved icon.
+
+    Holding the child keys means a cache hit needs no SELECT at all: the
+    icon row is updated by id and new children are inserted by ``icon_id``.
+    """
+
+    __slots__ = ("id", "image_urls", "inscriptions")
+
+    def __init__(self, icon_id: int) -> None:
+        # Query rather than read icon.images/.inscriptions: children are added
+        # by icon_id, so collections loaded earlier in this session are stale.
+        self.id = icon_id
+        self.image_urls = {
+            url for (url,) in db_session.query(IconImage.image_url).filter_by(icon_id=icon_id)
+        }
+        self.inscriptions = {
+            inscription_key(i)
+            for i in db_session.query(IconInscription).filter_by(icon_id=icon_id)
+        }
+
+
+def _icon_values(icon_meta: Dict[str, Any], key: str) -> Dict[str, Any]:
+    # Later submissions may fill in or correct descriptive fields
+    values = {f: icon_meta[f] for f in ICON_FIELDS if icon_meta.get(f) is not None}
+    values["natural_key"] = key
+    return values
+
+
+def _upsert_icon(icon_meta: Dict[str, Any]) -> _CachedIcon:
+    """Create or update the Icon matching *icon_meta* and return its cache entry.
+
+    Icons are matched on ``utils.icon_natural_key``. An icon first submitted
+    without a collection number is found through its content key and adopts
+    the number. The write runs in a SAVEPOINT so that losing an insert race
+    on the unique key falls back to updating the winner's row instead of
+    failing the annotation.
+
+    Resolved icons are kept in ``_icon_cache``; a hit costs one UPDATE by
+    primary key. The update is guarded on the natural key, so an icon that
+    was merged or re-keyed since falls through to a fresh lookup.
+    """
+    key = icon_natural_key(icon_meta)
+    content_key = icon_content_key(icon_meta)
+    values = _icon_values(icon_meta, key)
+
+    cached = _icon_cache.get(key)
+    if cached is not None:
+        updated = (
+            db_session.query(Icon)
+            .filter(Icon.id == cached.id, Icon.natural_key == key)
+            .update(values, synchronize_session=False)
+        )
+        if updated:
+            return cached
+        _icon_cache.discard(key)
+
+    icon = db_session.query(Icon).filter_by(natural_key=key).first()
+    if icon is None and key != content_key:
+        icon = db_session.query(Icon).filter_by(natural_key=content_key).first()
+        _icon_cache.discard(content_key)  # about to be re-keyed
+
+    try:
+        with db_session.begin_nested():
+            if icon is None:
+                icon = Icon(object_type="icon")
+                db_session.add(icon)
+            for field, value in values.items():
+                setattr(icon, field, value)
+            db_session.flush()  # obtain icon.id
+    except IntegrityError:
+        # Another request stored this key first; update its row instead
+        icon = db_session.query(Icon).filter_by(natural_key=key).first()
+        if icon is None:
+            raise  # not a key conflict
+        for field, value in values.items():
+            setattr(icon, field, value)
+        db_session.flush()
+
+    cached = _CachedIcon(icon.id)
+    _icon_cache.put(key, cached)
+    return cached
+
+
+def _rollback() -> None:
+    """Roll back the session and forget cached icon children it may have added."""
+    db_session.rollback()
+    _icon_cache.clear()
+
 # ---------------------------------------------------------------------------
 # Routes
 # ---------------------------------------------------------------------------
@@ -141,12 +328,50 @@ def upload_file():
     file.save(file_path)
     app.logger.info(f"File saved to {file_path}")
 
-    new_image = Image(filename=filename, source="", location="")
     try:
+        perceptual_hash = dhash(file_path)
+    except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+        # Not an image, or too large for Pillow to open: store without a hash
+        app.logger.warning(f"Could not hash {filename}: {e}")
+        perceptual_hash = None
+
+    new_image = Image(
+        filename=filename, source="", location="", perceptual_hash=perceptual_hash
+    )
+    try:
+        duplicates: List[Dict[str, Any]] = []
+        if perceptual_hash:
+            duplicates = phash_index.near_duplicates(perceptual_hash, PHASH_MAX_DISTANCE)
+
         db_session.add(new_image)
         db_session.commit()
         app.logger.info(f"Image record created with id {new_image.id}")
-        return jsonify({"message": "File uploaded", "image_id": new_image.id}), 200
+
+        if perceptual_hash:
+            phash_index.add(new_image.id, perceptual_hash)
+        if duplicates:
+            filenames = dict(
+                db_session.query(Image.id, Image.filename).filter(
+                    Image.id.in_([d["image_id"] for d in duplicates])
+                )
+            )
+            for d in duplicates:
+                d["filename"] = filenames.get(d["image_id"])
+            app.logger.info(
+                f"Image {new_image.id} resembles {[d['image_id'] for d in duplicates]}"
+            )
+
+        return (
+            jsonify(
+                {
+                    "message": "File uploaded",
+                    "image_id": new_image.id,
+                    "perceptual_hash": perceptual_hash,
+                    "possible_duplicates": duplicates,
+                }
+            ),
+            200,
+        )
     except SQLAlchemyError as e:
         db_session.rollback()
         app.logger.error(f"Database error: {e}")
@@ -176,16 +401,29 @@ def annotate():
             app.logger.error(f"Invalid gesture_id: {gesture_id}")
             return jsonify({"error": "Invalid gesture_id"}), 400
 
+    try:
+        box = normalise_region(region_coordinates)
+    except (KeyError, TypeError):
+        app.logger.error(f"Invalid region_coordinates: {region_coordinates}")
+        return jsonify({"error": "Invalid region_coordinates"}), 400
+
     # Create gesture instance (without crop yet)
     new_instance = GestureInstance(
         image_id=image_id,
         gesture_id=gesture_id,
         region_coordinates=region_coordinates,
+        box_x0=box[0],
+        box_y0=box[1],
+        box_x1=box[2],
+        box_y1=box[3],
         notes=notes,
         cropped_image_path="",
     )
 
     try:
+        # Warn about near-identical boxes already saved on this image
+        overlapping = _overlapping_instances(image_id, box, OVERLAP_MIN_IOU)
+
         db_session.add(new_instance)
         db_session.flush()  # ensure new_instance.id available
 
@@ -216,21 +454,40 @@ def annotate():
                     "message": "Annotation and metadata saved",
                     "gesture_instance_id": new_instance.id,
                     "cropped_image_path": crop_filename,
+                    "overlapping_instances": overlapping,
                 }
             ),
             200,
         )
 
     except SQLAlchemyError as e:
-        db_session.rollback()
+        _rollback()
         app.logger.error(f"Database error: {e}")
         return jsonify({"error": str(e)}), 500
     except Exception as e:
-        db_session.rollback()
+        _rollback()
         app.logger.error(f"Processing error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/images/<int:image_id>/overlaps", methods=["GET"])
+def region_overlaps(image_id: int):
+    """Gesture instances on *image_id* overlapping the box given as
+    ``x``, ``y``, ``width``, ``height`` (UI coordinates), optionally limited
+    to those with IoU of at least ``min_iou``."""
+    try:
+        rect = {k: float(request.args[k]) for k in ("x", "y", "width", "height")}
+        min_iou = float(request.args.get("min_iou", 0.0))
+    except (KeyError, ValueError):
+        return jsonify({"error": "x, y, width and height are required numbers"}), 400
+
+    try:
+        return jsonify(_overlapping_instances(image_id, normalise_region(rect), min_iou)), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"Database error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/gestures", methods=["GET"])
 def get_gestures():
     try:
@@ -253,6 +510,80 @@ def get_gestures():
         return jsonify({"error": str(e)}), 500
 
 
+# ---------------------------------------------------------------------------
+# Training-dataset export
+# ---------------------------------------------------------------------------
+_export_lock = threading.Lock()
+_export_status: Dict[str, Any] = {"running": False, "last_error": None}
+
+
+def _run_export(**options) -> None:
+    try:
+        summary = dataset_export.export_dataset(**options)
+        app.logger.info(f"Dataset export finished: {summary}")
+        _export_status["last_error"] = None
+    except Exception as e:
+        app.logger.error(f"Dataset export failed: {e}")
+        _export_status["last_error"] = str(e)
+    finally:
+        _export_status["running"] = False
+        _export_lock.release()
+
+
+@app.route("/exports", methods=["POST"])
+def start_export():
+    """Start a dataset export in the background.
+
+    Runs are incremental by default and pick up relabelled gestures and
+    edited icons on their own; send ``{"incremental": false}`` for a full export.
+    """
+    data = request.get_json(silent=True) or {}
+    incremental = data.get("incremental", True)
+    if not isinstance(incremental, bool):
+        return jsonify({"error": "incremental must be true or false"}), 400
+    try:
+        options = {
+            "incremental": incremental,
+            "shard_size": int(data.get("shard_size", 1000)),
+            "workers": int(data.get("workers", 4)),
+        }
+    except (TypeError, ValueError):
+        return jsonify({"error": "shard_size and workers must be integers"}), 400
+    if options["shard_size"] < 1 or options["workers"] < 1:
+        return jsonify({"error": "shard_size and workers must be at least 1"}), 400
+
+    if not _export_lock.acquire(blocking=False):
+        return jsonify({"error": "An export is already running"}), 409
+    _export_status["running"] = True
+    threading.Thread(target=_run_export, kwargs=options, daemon=True).start()
+    return jsonify({"message": "Export started", **options}), 202
+
+
+@app.route("/exports", methods=["GET"])
+def export_status():
+    state = dataset_export.load_state()
+    return (
+        jsonify(
+            {
+                **_export_status,
+                "version": state["version"],
+                "last_run": state["runs"][-1] if state["runs"] else None,
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/exports/<run_id>/<path:filename>")
+def serve_export(run_id: str, filename: str):
+    # Only files of completed runs; never state.json, .lock or failed runs
+    out_dir = dataset_export.EXPORTS_FOLDER
+    runs = {run["run_id"] for run in dataset_export.load_state(out_dir)["runs"]}
+    if run_id not in runs:
+        return jsonify({"error": "Unknown export run"}), 404
+    return send_from_directory(out_dir / run_id, filename)
+
+
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename: str):
     return send_from_directory(UPLOAD_FOLDER, filename)
@@ -264,4 +595,7 @@ def serve_crop(filename: str):
 
 
 if __name__ == "__main__":
+    # Build the near-duplicate index in the background so the first upload
+    # does not pay for loading it.
+    threading.Thread(target=phash_index.load, daemon=True).start()
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,75 @@
+"""
+backfill_phash.py – compute perceptual hashes for existing uploads
+------------------------------------------------------------------
+• Finds Image rows without a ``perceptual_hash``.
+• Hashes the files in ``uploads/`` across a process pool.
+• Writes the results back in batches.
+
+Run after ``sql/003_image_perceptual_hash.sql``, then restart the backend so
+its near-duplicate index picks the new hashes up:
+
+    python backfill_phash.py [--workers N] [--batch-size N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image as PILImage
+
+from models import Image, get_session
+from utils import dhash
+
+UPLOAD_FOLDER = Path(__file__).resolve().parent / "uploads"
+
+
+def _hash_one(job: Tuple[int, str]) -> Tuple[int, Optional[str]]:
+    image_id, filename = job
+    try:
+        return image_id, dhash(UPLOAD_FOLDER / filename)
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return image_id, None  # missing, not an image, or too large to open
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with get_session() as session:
+        jobs = (
+            session.query(Image.id, Image.filename)
+            .filter(Image.perceptual_hash.is_(None))
+            .order_by(Image.id)
+            .all()
+        )
+        print(f"{len(jobs)} images to hash")
+
+        hashed = skipped = 0
+        pending = []
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for image_id, value in pool.map(_hash_one, jobs, chunksize=16):
+                if value is None:
+                    skipped += 1
+                    continue
+                pending.append({"id": image_id, "perceptual_hash": value})
+                if len(pending) >= args.batch_size:
+                    session.bulk_update_mappings(Image, pending)
+                    session.commit()
+                    hashed += len(pending)
+                    pending.clear()
+        if pending:
+            session.bulk_update_mappings(Image, pending)
+            session.commit()
+            hashed += len(pending)
+
+        print(f"Hashed {hashed} images, skipped {skipped} unreadable files")
+
+
+if __name__ == "__main__":
+    main()
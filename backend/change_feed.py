@@ -0,0 +1,165 @@
+"""
+change_feed.py – record Image / GestureInstance changes for the report feed
+--------------------------------------------------------------------------
+• ``register(SessionLocal)`` hooks ``after_flush`` on the session factory.
+• Each flushed insert, update or delete is written to ``change_events`` in
+  the same transaction, so an event exists if and only if the change commits.
+• Writers take a transaction-level advisory lock before inserting, so event
+  ids are allocated in commit order and a reader that has seen id N will
+  never later find a smaller id appear.
+• A ``pg_notify`` on the ``change_events`` channel wakes report-backend
+  listeners when the transaction commits.
+• ``prune()`` / ``python change_feed.py --keep-days N`` trims old events and
+  records how far it got in ``change_feed_state``; see ``pruned_through()``.
+
+Run pruning after ``sql/006_change_events_retention.sql`` and
+``sql/007_change_feed_state.sql``.
+"""
+
+from __future__ import annotations
+
+import argparse
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, func, inspect, text
+
+from models import ChangeEvent, ChangeFeedState, GestureInstance, Image, get_session
+
+NOTIFY_CHANNEL = "change_events"
+# Arbitrary constant identifying the outbox writer lock
+OUTBOX_LOCK_ID = 0x6368616E6765  # "change"
+
+# ORM class -> (entity name, attributes copied into the event payload)
+TRACKED = {
+    Image: ("image", ()),
+    GestureInstance: ("gesture_instance", ("image_id",)),
+}
+
+
+def _event(obj: Any, op: str) -> Dict[str, Any]:
+    entity, fields = TRACKED[type(obj)]
+    loaded = inspect(obj).dict  # avoid lazy loads while flushing
+    return {
+        "entity": entity,
+        "entity_id": obj.id,
+        "op": op,
+        "payload": {f: loaded.get(f) for f in fields},
+    }
+
+
+def _collect_events(session) -> List[Dict[str, Any]]:
+    """Events for the tracked objects *session* is about to flush."""
+    events: List[Dict[str, Any]] = []
+    for obj in session.new:
+        if type(obj) in TRACKED:
+            events.append(_event(obj, "insert"))
+    for obj in session.dirty:
+        if type(obj) in TRACKED and session.is_modified(obj, include_collections=False):
+            events.append(_event(obj, "update"))
+    for obj in session.deleted:
+        if type(obj) in TRACKED:
+            events.append(_event(obj, "delete"))
+    return events
+
+
+def _record_changes(session, flush_context) -> None:
+    events = _collect_events(session)
+    if not events:
+        return
+
+    connection = session.connection()
+    # Held until commit/rollback: an id is only drawn from the sequence once
+    # every earlier writer has committed, so ids become visible in order.
+    # This serialises annotation commits, which are short and infrequent.
+    connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": OUTBOX_LOCK_ID})
+    connection.execute(ChangeEvent.__table__.insert(), events)
+    # Delivered on commit; duplicate notifications in one transaction collapse
+    connection.execute(text("SELECT pg_notify(:channel, '')"), {"channel": NOTIFY_CHANNEL})
+
+
+def register(session_factory) -> None:
+    """Start recording changes made through sessions from *session_factory*."""
+    event.listen(session_factory, "after_flush", _record_changes)
+
+
+def pruned_through(session) -> int:
+    """Highest event id removed by ``prune()``; 0 if nothing was pruned.
+
+    A reader at version ``v`` has missed events if ``v < pruned_through``.
+    Rolled-back writers leave gaps in the ids, so the lowest surviving id
+    cannot tell a pruned range from an unused one.
+    """
+    return session.query(ChangeFeedState.pruned_through).filter_by(id=1).scalar() or 0
+
+
+def _prune_bound(
+    expired: Optional[int], latest: Optional[int], keep_after: Optional[int]
+) -> Optional[int]:
+    """Highest id that may be deleted, or None if nothing may be.
+
+    -> *expired* is the highest id older than the retention window.
+    -> The newest event (*latest*) is kept so the feed version survives.
+    -> Nothing above *keep_after* is deleted.
+    """
+    if expired is None or latest is None:
+        return None
+    bound = min(expired, latest - 1)
+    if keep_after is not None:
+        bound = min(bound, keep_after)
+    return bound if bound > 0 else None
+
+
+def prune(session, keep_days: int, keep_after: Optional[int] = None) -> int:
+    """Delete events older than *keep_days*, returning how many were removed.
+
+    Events above *keep_after* (e.g. the last dataset-export version) and the
+    newest event are always kept, so incremental consumers and the feed
+    version survive. The pruned range is recorded in ``change_feed_state``
+    in the same transaction; report clients behind it get ``reset``.
+    """
+    # created_at is set by the database clock, so compare against it too
+    expired = (
+        session.query(func.max(ChangeEvent.id))
+        .filter(ChangeEvent.created_at < func.now() - timedelta(days=keep_days))
+        .scalar()
+    )
+    latest = session.query(func.max(ChangeEvent.id)).scalar()
+    bound = _prune_bound(expired, latest, keep_after)
+    if bound is None:
+        return 0
+
+    # Row lock: concurrent prunes record the marker one after the other
+    state = session.get(ChangeFeedState, 1, with_for_update=True)
+    if state is None:
+        state = ChangeFeedState(id=1, pruned_through=0)
+        session.add(state)
+    deleted = (
+        session.query(ChangeEvent)
+        .filter(ChangeEvent.id <= bound)
+        .delete(synchronize_session=False)
+    )
+    state.pruned_through = max(state.pruned_through or 0, bound)
+    session.commit()
+    return deleted
+
+
+def main() -> None:
+    import dataset_export  # only needed for the export bound
+
+    parser = argparse.ArgumentParser(description="Prune the change_events outbox.")
+    parser.add_argument("--keep-days", type=int, default=30)
+    parser.add_argument(
+        "--ignore-exports",
+        action="store_true",
+        help="also prune events the next incremental dataset export still needs",
+    )
+    args = parser.parse_args()
+
+    keep_after = None if args.ignore_exports else dataset_export.load_state()["version"]
+    with get_session() as session:
+        print(f"Pruned {prune(session, args.keep_days, keep_after)} change events")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# backend/conftest.py – shared pytest setup for the backend unit tests
+
+import os
+
+# models.py refuses to import without a DATABASE_URL. The unit tests never
+# connect, so any well-formed URL will do.
+os.environ.setdefault("DATABASE_URL", "postgresql://annotator@localhost/gesture_test")
+
+# test_models.py creates the schema in a live database; run it by hand.
+collect_ignore = ["test_models.py"]
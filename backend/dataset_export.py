@@ -0,0 +1,541 @@
+"""
+dataset_export.py – stream gesture crops and labels into training shards
+-----------------------------------------------------------------------
+• Rows are read through a server-side cursor, never all at once.
+• Reader threads load crop bytes; a single writer thread packs them into
+  WebDataset-style tar shards (``<key>.jpg`` + ``<key>.json``) and appends a
+  line per sample to ``manifest.jsonl``. Bounded queues keep memory flat.
+• Icon metadata comes from the ``icons`` row each instance's notes resolve
+  to, matched on the natural key as ``/annotate`` stores it.
+• Incremental runs export only instances changed since the previous run,
+  using the ``change_events`` outbox, plus instances whose gesture labels or
+  icon changed, and list deletions in the manifest.
+• One run at a time per output folder (``.lock``); a second run fails fast.
+
+Layout under the output folder:
+
+    state.json                  last exported version, label/icon fingerprints, runs
+    <run_id>/shard-000000.tar   samples
+    <run_id>/manifest.jsonl     one JSON line per sample or deletion
+
+Command line:
+
+    python dataset_export.py [--full] [--shard-size N] [--workers N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import fcntl
+import hashlib
+import io
+import json
+import queue
+import tarfile
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import selectinload
+
+from models import (
+    ChangeEvent,
+    ClassificationSystem,
+    ClassificationSystemGesture,
+    Gesture,
+    GestureInstance,
+    Icon,
+    Image,
+    get_session,
+)
+import change_feed
+from utils import icon_content_key, icon_natural_key
+
+ROOT_DIR = Path(__file__).resolve().parent
+CROPS_FOLDER = ROOT_DIR / "gesture_instance_crops"
+EXPORTS_FOLDER = ROOT_DIR / "exports"
+
+# Icon / IconInscription columns written into each sample's "icon" record
+ICON_EXPORT_FIELDS = (
+    "title",
+    "object_type",
+    "museum_collection_number",
+    "iconographic_variant_id",
+    "culture_period",
+    "date_approx",
+    "place_of_creation",
+    "current_location",
+    "materials",
+    "techniques",
+    "dimensions_mm",
+)
+INSCRIPTION_EXPORT_FIELDS = ("language", "text", "location_on_icon", "script_type", "translation")
+
+_DONE = object()  # end-of-stream marker passed through the queues
+
+
+class ExportError(RuntimeError):
+    """Raised when a pipeline worker fails; the partial run is not recorded."""
+
+
+# ---------------------------------------------------------------------------
+# State
+# ---------------------------------------------------------------------------
+
+
+def load_state(out_dir: Path = EXPORTS_FOLDER) -> Dict[str, Any]:
+    path = out_dir / "state.json"
+    if not path.exists():
+        return {"version": None, "runs": []}
+    return json.loads(path.read_text())
+
+
+def _save_state(out_dir: Path, state: Dict[str, Any]) -> None:
+    tmp = out_dir / "state.json.tmp"
+    tmp.write_text(json.dumps(state, indent=2))
+    tmp.replace(out_dir / "state.json")
+
+
+# ---------------------------------------------------------------------------
+# Pipeline stages
+# ---------------------------------------------------------------------------
+
+
+def _put(q: queue.Queue, item: Any, failed: threading.Event) -> None:
+    """Block on a full queue, but give up if another stage has failed."""
+    while True:
+        if failed.is_set():
+            raise ExportError("export aborted")
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _icon_from_notes(notes: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not notes or not notes.strip().startswith("{"):
+        return None
+    try:
+        meta = json.loads(notes)
+    except json.JSONDecodeError:
+        return None
+    icon = meta.get("icon") if isinstance(meta, dict) else None
+    return icon or None
+
+
+def _read_crops(rows: queue.Queue, samples: queue.Queue, failed, errors) -> None:
+    """Load crop bytes for each row; ``None`` marks a missing crop file."""
+    while True:
+        row = rows.get()
+        if row is _DONE:
+            break
+        if failed.is_set():
+            continue  # drain so the producer is never left blocked
+        try:
+            path = CROPS_FOLDER / (row["cropped_image_path"] or "")
+            crop = path.read_bytes() if row["cropped_image_path"] and path.is_file() else None
+            samples.put((row, crop))
+        except Exception as e:  # surfaced by export_dataset
+            errors.append(e)
+            failed.set()
+    samples.put(_DONE)
+
+
+def _write_shards(
+    samples: queue.Queue, run_dir: Path, shard_size: int, readers: int, failed, errors, stats
+) -> None:
+    """Pack samples into tar shards and the manifest until every reader is done."""
+    tar: Optional[tarfile.TarFile] = None
+    manifest = None
+    in_shard = 0
+    try:
+        while readers:
+            item = samples.get()
+            if item is _DONE:
+                readers -= 1
+                continue
+            if failed.is_set():
+                continue  # drain so readers are never left blocked
+            try:
+                row, crop = item
+                if crop is None:
+                    stats["missing_crops"] += 1
+                    continue
+
+                if tar is None or in_shard >= shard_size:
+                    if tar is not None:
+                        tar.close()
+                    shard_name = f"shard-{stats['shards']:06d}.tar"
+                    tar = tarfile.open(run_dir / shard_name, "w")
+                    stats["shards"] += 1
+                    in_shard = 0
+                if manifest is None:
+                    # Appends after any deletion records written up front
+                    manifest = open(run_dir / "manifest.jsonl", "a", encoding="utf-8")
+
+                key = f"{row['gesture_instance_id']:09d}"
+                meta = {k: v for k, v in row.items() if k != "cropped_image_path"}
+                meta_bytes = json.dumps(meta, default=str).encode("utf-8")
+                for name, data in ((f"{key}.jpg", crop), (f"{key}.json", meta_bytes)):
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+                in_shard += 1
+
+                manifest.write(
+                    json.dumps({"key": key, "shard": shard_name, **meta}, default=str) + "\n"
+                )
+                stats["samples"] += 1
+            except Exception as e:  # surfaced by export_dataset
+                errors.append(e)
+                failed.set()
+    finally:
+        if tar is not None:
+            tar.close()
+        if manifest is not None:
+            manifest.close()
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+
+def _run_pipeline(
+    rows: Iterable[Dict[str, Any]],
+    run_dir: Path,
+    shard_size: int,
+    workers: int,
+    queue_size: int,
+    stats: Dict[str, int],
+) -> None:
+    """Feed *rows* through the reader threads into the shard writer.
+
+    Raises ExportError if the row source or any worker fails; all threads
+    have stopped by the time this returns or raises.
+    """
+    errors: List[Exception] = []
+    failed = threading.Event()
+    rows_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    samples_q: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    readers = [
+        threading.Thread(
+            target=_read_crops, args=(rows_q, samples_q, failed, errors), daemon=True
+        )
+        for _ in range(workers)
+    ]
+    writer = threading.Thread(
+        target=_write_shards,
+        args=(samples_q, run_dir, shard_size, workers, failed, errors, stats),
+        daemon=True,
+    )
+    for t in readers + [writer]:
+        t.start()
+
+    try:
+        for row in rows:
+            _put(rows_q, row, failed)
+    except Exception as e:
+        errors.append(e)
+        failed.set()
+    finally:
+        for _ in readers:
+            rows_q.put(_DONE)  # readers keep draining, so this cannot stall
+        for t in readers + [writer]:
+            t.join()
+
+    if errors:
+        raise ExportError(f"export {run_dir.name} failed: {errors[0]}") from errors[0]
+
+
+@contextmanager
+def _exclusive(out_dir: Path) -> Iterator[None]:
+    """Hold an exclusive lock on *out_dir* so runs never share ``state.json``."""
+    with open(out_dir / ".lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ExportError("another export is already running") from None
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _new_run_id() -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    return f"{stamp}-{uuid.uuid4().hex[:8]}"
+
+
+def _label_signatures(
+    gesture_names: Dict[int, str], labels: Dict[int, List[Dict[str, str]]]
+) -> Dict[str, str]:
+    """Fingerprint each gesture's exported labels, keyed by str(gesture_id)."""
+    signatures = {}
+    for gesture_id, name in gesture_names.items():
+        body = json.dumps(
+            [name, sorted(labels.get(gesture_id, []), key=lambda e: (e["system"], e["label"] or ""))],
+            ensure_ascii=False,
+        )
+        signatures[str(gesture_id)] = hashlib.sha1(body.encode("utf-8")).hexdigest()
+    return signatures
+
+
+def _load_icons(session) -> Dict[str, Dict[str, Any]]:
+    """Export records for every keyed icon, by natural key."""
+    icons = {}
+    query = (
+        session.query(Icon)
+        .filter(Icon.natural_key.isnot(None))
+        .options(selectinload(Icon.images), selectinload(Icon.inscriptions))
+    )
+    for icon in query:
+        record = {f: getattr(icon, f) for f in ICON_EXPORT_FIELDS}
+        record["images"] = sorted(i.image_url for i in icon.images)
+        record["inscriptions"] = sorted(
+            ({f: getattr(i, f) for f in INSCRIPTION_EXPORT_FIELDS} for i in icon.inscriptions),
+            key=lambda i: json.dumps(i, sort_keys=True, ensure_ascii=False),
+        )
+        icons[icon.natural_key] = record
+    return icons
+
+
+def _icon_signatures(icons: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Fingerprint each icon record, keyed by natural key."""
+    return {
+        key: hashlib.sha1(
+            json.dumps(record, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+        ).hexdigest()
+        for key, record in icons.items()
+    }
+
+
+def _icon_keys(meta: Optional[Dict[str, Any]]) -> Tuple[str, ...]:
+    """Natural keys the icon described by *meta* may be stored under.
+
+    Ordered as ``/annotate`` tries them: collection number, then content.
+    """
+    if not meta:
+        return ()
+    key, content_key = icon_natural_key(meta), icon_content_key(meta)
+    return (key,) if key == content_key else (key, content_key)
+
+
+def _iter_rows(
+    session,
+    stmt,
+    labels,
+    icons: Dict[str, Dict[str, Any]],
+    yield_per: int,
+    stats: Dict[str, int],
+    changed_icons: Optional[Set[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield one sample record per row of *stmt*.
+
+    -> With *changed_icons*, *stmt* selects every instance plus a ``picked``
+       column; rows that were not picked are skipped unless their icon is one
+       of *changed_icons*.
+    """
+    # Server-side cursor: rows arrive in batches of yield_per
+    for r in session.execute(stmt.execution_options(yield_per=yield_per)):
+        keys = _icon_keys(_icon_from_notes(r.notes))
+        if changed_icons and not r.picked and changed_icons.isdisjoint(keys):
+            continue
+        icon_key = next((k for k in keys if k in icons), None)
+        if keys and icon_key is None:
+            stats["unresolved_icons"] += 1  # icon row merged away or never stored
+        yield {
+            "gesture_instance_id": r.id,
+            "image_id": r.image_id,
+            "image_filename": r.filename,
+            "gesture_id": r.gesture_id,
+            "gesture": r.name,
+            "labels": labels.get(r.gesture_id, []),
+            "region_coordinates": r.region_coordinates,
+            "box": [r.box_x0, r.box_y0, r.box_x1, r.box_y1],
+            "icon_key": icon_key,
+            "icon": icons.get(icon_key),
+            "cropped_image_path": r.cropped_image_path,
+        }
+
+
+def export_dataset(
+    out_dir: Path = EXPORTS_FOLDER,
+    incremental: bool = True,
+    shard_size: int = 1000,
+    workers: int = 4,
+    queue_size: int = 256,
+    yield_per: int = 500,
+) -> Dict[str, Any]:
+    """Export gesture instances and return a summary of the run.
+
+    -> *incremental* exports only instances changed since the last recorded
+       run, plus those whose gesture name, classification labels or icon
+       changed.
+       A full export is made when there is no previous run or the events it
+       would need have been pruned.
+    -> *shard_size* is the number of samples per tar shard.
+    -> *workers* is the number of crop reader threads.
+    """
+    for name, value in (("shard_size", shard_size), ("workers", workers),
+                        ("queue_size", queue_size), ("yield_per", yield_per)):
+        if value < 1:
+            raise ValueError(f"{name} must be at least 1, got {value}")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with _exclusive(out_dir):
+        state = load_state(out_dir)
+        run_id = _new_run_id()
+        run_dir = out_dir / run_id
+        run_dir.mkdir()
+        stats: Dict[str, int] = defaultdict(int)
+
+        with get_session() as session:
+            # Fix the upper bound first: anything changed while we stream is
+            # picked up again by the next incremental run. change_feed
+            # allocates ids in commit order, so no lower id can commit later.
+            version = session.query(func.coalesce(func.max(ChangeEvent.id), 0)).scalar()
+
+            gesture_names = dict(session.query(Gesture.id, Gesture.name))
+            labels: Dict[int, List[Dict[str, str]]] = defaultdict(list)
+            for system_name, gesture_id, label in (
+                session.query(
+                    ClassificationSystem.name,
+                    ClassificationSystemGesture.gesture_id,
+                    ClassificationSystemGesture.label,
+                )
+                .select_from(ClassificationSystemGesture)
+                .join(ClassificationSystemGesture.system)
+            ):
+                labels[gesture_id].append({"system": system_name, "label": label})
+            signatures = _label_signatures(gesture_names, labels)
+            icons = _load_icons(session)
+            icon_signatures = _icon_signatures(icons)
+
+            since = state["version"] if incremental else None
+            if since is not None and since < change_feed.pruned_through(session):
+                since = None  # events we would need were pruned
+
+            stmt = (
+                select(
+                    GestureInstance.id,
+                    GestureInstance.image_id,
+                    GestureInstance.gesture_id,
+                    GestureInstance.region_coordinates,
+                    GestureInstance.box_x0,
+                    GestureInstance.box_y0,
+                    GestureInstance.box_x1,
+                    GestureInstance.box_y1,
+                    GestureInstance.cropped_image_path,
+                    GestureInstance.notes,
+                    Image.filename,
+                    Gesture.name,
+                )
+                .join(Image, Image.id == GestureInstance.image_id)
+                .outerjoin(Gesture, Gesture.id == GestureInstance.gesture_id)
+                .order_by(GestureInstance.id)
+            )
+            relabelled: List[int] = []
+            changed_icons: Set[str] = set()
+            if since is not None:
+                # Label and icon edits are not instance changes, so compare
+                # fingerprints with the previous run instead.
+                previous = state.get("labels", {})
+                relabelled = [
+                    int(gid) for gid, sig in signatures.items() if previous.get(gid) != sig
+                ]
+                previous_icons = state.get("icons", {})
+                changed_icons = {
+                    key
+                    for key in previous_icons.keys() | icon_signatures.keys()
+                    if previous_icons.get(key) != icon_signatures.get(key)
+                }
+                changed = select(ChangeEvent.entity_id).where(
+                    ChangeEvent.entity == "gesture_instance",
+                    ChangeEvent.id > since,
+                    ChangeEvent.id <= version,
+                )
+                picked = or_(
+                    GestureInstance.id.in_(changed),
+                    GestureInstance.gesture_id.in_(relabelled),
+                )
+                if changed_icons:
+                    # Instances are tied to icons through their notes, which
+                    # SQL cannot match on, so scan them all and filter as we go
+                    stmt = stmt.add_columns(picked.label("picked"))
+                else:
+                    stmt = stmt.where(picked)
+
+                deleted = session.scalars(
+                    changed.where(ChangeEvent.op == "delete").distinct()
+                ).all()
+                with open(run_dir / "manifest.jsonl", "w", encoding="utf-8") as manifest:
+                    for instance_id in deleted:
+                        manifest.write(
+                            json.dumps({"key": f"{instance_id:09d}", "deleted": True}) + "\n"
+                        )
+                stats["deleted"] = len(deleted)
+
+            _run_pipeline(
+                _iter_rows(session, stmt, labels, icons, yield_per, stats, changed_icons),
+                run_dir,
+                shard_size,
+                workers,
+                queue_size,
+                stats,
+            )
+
+        summary = {
+            "run_id": run_id,
+            "incremental": since is not None,
+            "since": since,
+            "version": version,
+            "relabelled_gestures": relabelled,
+            "changed_icons": len(changed_icons),
+            "samples": stats["samples"],
+            "deleted": stats["deleted"],
+            "missing_crops": stats["missing_crops"],
+            "unresolved_icons": stats["unresolved_icons"],
+            "shards": stats["shards"],
+        }
+        state["version"] = version
+        state["labels"] = signatures
+        state["icons"] = icon_signatures
+        state["runs"].append(summary)
+        _save_state(out_dir, state)
+        return summary
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--full", action="store_true", help="ignore the last run and export everything")
+    parser.add_argument("--out", type=Path, default=EXPORTS_FOLDER)
+    parser.add_argument("--shard-size", type=_positive_int, default=1000)
+    parser.add_argument("--workers", type=_positive_int, default=4)
+    args = parser.parse_args()
+
+    try:
+        summary = export_dataset(
+            args.out, incremental=not args.full, shard_size=args.shard_size, workers=args.workers
+        )
+    except ExportError as e:
+        parser.exit(1, f"{e}\n")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+merge_duplicate_icons.py – one-off clean-up of duplicate Icon rows
+------------------------------------------------------------------
+• Groups icons on ``utils.icon_natural_key`` (collection number or content
+  hash); an icon without a number joins the numbered icon with its content.
+• Keeps the oldest icon in each group and moves the images and inscriptions of
+  the others onto it, dropping exact duplicates.
+• Deletes the redundant icons and records the natural key on the survivors so
+  ``/annotate`` upserts onto them from now on.
+
+Run after ``sql/002_icon_natural_key.sql``:
+
+    python merge_duplicate_icons.py [--dry-run]
+
+Restart the backend afterwards so its in-process icon cache is rebuilt.
+"""
+
+from __future__ import annotations
+
+import argparse
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from models import Icon, get_session
+from utils import ICON_IDENTITY_FIELDS, icon_content_key, icon_natural_key, inscription_key
+
+ICON_KEY_FIELDS = ICON_IDENTITY_FIELDS + ("museum_collection_number",)
+
+
+def _meta_for(icon: Icon) -> Dict[str, object]:
+    return {f: getattr(icon, f) for f in ICON_KEY_FIELDS}
+
+
+def group_icons(icons: Iterable[Icon]) -> Dict[str, List[Icon]]:
+    """Group *icons* by natural key, each group ordered by id.
+
+    Icons without a collection number join the oldest collection-numbered
+    group with the same content key, matching how ``/annotate`` adopts them.
+    """
+    groups: Dict[str, List[Icon]] = defaultdict(list)
+    for icon in sorted(icons, key=lambda i: i.id):
+        groups[icon_natural_key(_meta_for(icon))].append(icon)
+
+    numbered_by_content: Dict[str, str] = {}
+    for key, group in groups.items():
+        if key.startswith("mcn:"):
+            content_key = icon_content_key(_meta_for(group[0]))
+            current = numbered_by_content.get(content_key)
+            if current is None or groups[current][0].id > group[0].id:
+                numbered_by_content[content_key] = key
+
+    for content_key, key in numbered_by_content.items():
+        if content_key in groups:
+            groups[key] = sorted(groups[key] + groups.pop(content_key), key=lambda i: i.id)
+    return dict(groups)
+
+
+def _merge_into(keeper: Icon, duplicate: Icon, session) -> None:
+    """Move children of *duplicate* onto *keeper*, skipping ones it already has."""
+    known_urls = {i.image_url for i in keeper.images}
+    for image in list(duplicate.images):
+        if image.image_url in known_urls:
+            session.delete(image)
+        else:
+            known_urls.add(image.image_url)
+            image.icon = keeper
+
+    known = {inscription_key(i) for i in keeper.inscriptions}
+    for inscription in list(duplicate.inscriptions):
+        key = inscription_key(inscription)
+        if key in known:
+            session.delete(inscription)
+        else:
+            known.add(key)
+            inscription.icon = keeper
+
+    session.delete(duplicate)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report groups without changing anything"
+    )
+    args = parser.parse_args()
+
+    with get_session() as session:
+        groups = group_icons(session.query(Icon))
+
+        duplicates = {k: g for k, g in groups.items() if len(g) > 1}
+        removed = sum(len(g) - 1 for g in duplicates.values())
+        print(f"{len(groups)} distinct icons, {removed} duplicates in {len(duplicates)} groups")
+        if args.dry_run:
+            for key, group in duplicates.items():
+                print(f"  {key}: keep {group[0].id}, merge {[i.id for i in group[1:]]}")
+            return
+
+        # Keys may have been recorded under older metadata; clear them first so
+        # reassignment below cannot collide with the unique index.
+        for group in groups.values():
+            for icon in group:
+                icon.natural_key = None
+        session.flush()
+
+        for group in duplicates.values():
+            keeper = group[0]
+            for duplicate in group[1:]:
+                _merge_into(keeper, duplicate, session)
+        session.flush()
+
+        for key, group in groups.items():
+            keeper = group[0]
+            keeper.natural_key = key
+            if not keeper.museum_collection_number:
+                # Adopted an icon first submitted without its number
+                keeper.museum_collection_number = next(
+                    (i.museum_collection_number for i in group if i.museum_collection_number),
+                    None,
+                )
+
+        session.commit()
+        print(f"Merged {removed} duplicate icons")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ models.py – SQLAlchemy models for Gesture-Annotator + Icon-catalogue
 • Defines engine, SessionLocal, Base      (no global db_session)
 • Includes the original gesture tables
 • Includes the new icon-catalogue tables
+• Includes the change-feed outbox read by the report backend
 • Supplies `get_session()` for context-managed work.
 """
 
@@ -14,10 +15,15 @@ from typing import List
 
 from sqlalchemy import (
     ARRAY,
+    BigInteger,
+    CheckConstraint,
     Column,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     JSON,
+    SmallInteger,
     String,
     Text,
     TIMESTAMP,
@@ -53,6 +59,7 @@ class Image(Base):
     source = Column(String)
     location = Column(String)
     upload_timestamp = Column(TIMESTAMP, server_default=func.now())
+    perceptual_hash = Column(String(16))  # 64-bit dHash, hex
 
     gesture_instances = relationship(
         "GestureInstance", back_populates="image", cascade="all, delete-orphan"
@@ -76,6 +83,11 @@ class GestureInstance(Base):
     image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"))
     gesture_id = Column(Integer, ForeignKey("gestures.id"), nullable=True)
     region_coordinates = Column(JSON, nullable=False)
+    # Normalised region box (fractions of image size), see utils.normalise_region
+    box_x0 = Column(Float)
+    box_y0 = Column(Float)
+    box_x1 = Column(Float)
+    box_y1 = Column(Float)
     cropped_image_path = Column(Text)
     notes = Column(Text)
 
@@ -84,6 +96,10 @@ class GestureInstance(Base):
     image = relationship("Image", back_populates="gesture_instances")
     gesture = relationship("Gesture", back_populates="gesture_instances")
 
+    __table_args__ = (
+        Index("ix_gesture_instances_image_box", "image_id", "box_x0", "box_x1"),
+    )
+
 
 # ------------------------------------------------------------------ #
 # Icon-catalogue hierarchy                                           #
@@ -140,6 +156,7 @@ class Icon(Base):
     title = Column(Text, nullable=False)
     object_type = Column(Text, default="icon")
     museum_collection_number = Column(Text)
+    natural_key = Column(Text, unique=True)  # see utils.icon_natural_key
     culture_period = Column(Text)
     date_approx = Column(Text)
     place_of_creation = Column(Text)
@@ -224,6 +241,41 @@ class ClassificationSystemGesture(Base):
     gesture = relationship("Gesture")
 
 
+# ------------------------------------------------------------------ #
+# Change feed outbox                                                 #
+# ------------------------------------------------------------------ #
+
+
+class ChangeEvent(Base):
+    """One insert/update/delete of an Image or GestureInstance.
+
+    Written in the same transaction as the change itself (see
+    ``change_feed.py``); ``id`` doubles as the feed version.
+    """
+
+    __tablename__ = "change_events"
+
+    id = Column(BigInteger, primary_key=True)
+    entity = Column(String, nullable=False)  # "image" | "gesture_instance"
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "insert" | "update" | "delete"
+    payload = Column(JSON, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now(), index=True)
+
+
+class ChangeFeedState(Base):
+    """Single row recording the highest ``change_events.id`` pruned so far.
+
+    Ids can be skipped by rolled-back transactions, so readers compare their
+    version against ``pruned_through`` rather than the lowest surviving id.
+    """
+
+    __tablename__ = "change_feed_state"
+
+    id = Column(SmallInteger, CheckConstraint("id = 1"), primary_key=True, default=1)
+    pruned_through = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
 # ------------------------------------------------------------------ #
 # Convenience helper                                                 #
 # ------------------------------------------------------------------ #
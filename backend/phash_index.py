@@ -0,0 +1,134 @@
+"""
+phash_index.py – in-memory near-duplicate index over Image perceptual hashes
+---------------------------------------------------------------------------
+• ``MultiIndexHashTable`` answers Hamming-distance range queries over 64-bit
+  hashes by probing exact-match buckets on hash substrings, so a query looks
+  at a handful of candidates rather than every upload.
+• ``PHashIndex`` wraps one that is filled from the ``images`` table on first
+  use and kept current as new uploads are hashed.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import defaultdict
+from itertools import combinations
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils import hamming_distance
+
+
+class MultiIndexHashTable:
+    """Multi-index hashing over fixed-width integer hashes.
+
+    The hash is split into *chunks* substrings, each with its own table of
+    substring -> ids. If two hashes are within distance *r*, then by the
+    pigeonhole principle at least one substring pair is within ``r // chunks``,
+    so a query probes every substring value within that radius and verifies
+    the candidates with a full Hamming distance.
+
+    With four 16-bit chunks a radius up to 7 probes 17 buckets per chunk and
+    a radius up to 11 probes 137; beyond that the probe count climbs steeply
+    and a flat scan becomes competitive.
+    """
+
+    def __init__(self, bits: int = 64, chunks: int = 4) -> None:
+        if bits % chunks:
+            raise ValueError("bits must divide evenly into chunks")
+        self.bits = bits
+        self.chunks = chunks
+        self._width = bits // chunks
+        self._mask = (1 << self._width) - 1
+        self._tables: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(chunks)]
+        self._hashes: Dict[int, int] = {}  # item id -> hash
+        self._probes: Dict[int, List[int]] = {}  # chunk radius -> XOR masks
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._hashes
+
+    def _substrings(self, value: int) -> Iterable[Tuple[int, int]]:
+        for i in range(self.chunks):
+            yield i, (value >> (i * self._width)) & self._mask
+
+    def _masks(self, radius: int) -> List[int]:
+        """XOR masks flipping up to *radius* bits of one substring."""
+        if radius not in self._probes:
+            masks = [0]
+            for k in range(1, min(radius, self._width) + 1):
+                for bits in combinations(range(self._width), k):
+                    masks.append(sum(1 << b for b in bits))
+            self._probes[radius] = masks
+        return self._probes[radius]
+
+    def add(self, value: int, item_id: int) -> bool:
+        """Index *item_id*; returns False if it was already present."""
+        if item_id in self._hashes:
+            return False
+        self._hashes[item_id] = value
+        for i, sub in self._substrings(value):
+            self._tables[i][sub].append(item_id)
+        return True
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """Return ``(item_id, distance)`` pairs within *max_distance*, nearest first."""
+        masks = self._masks(max_distance // self.chunks)
+        candidates: Set[int] = set()
+        for i, sub in self._substrings(value):
+            get = self._tables[i].get
+            for mask in masks:
+                bucket = get(sub ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        hashes = self._hashes
+        matches: List[Tuple[int, int]] = []
+        for item_id in candidates:
+            distance = hamming_distance(value, hashes[item_id])
+            if distance <= max_distance:
+                matches.append((item_id, distance))
+        matches.sort(key=lambda m: m[1])
+        return matches
+
+
+class PHashIndex:
+    """Lazily loaded, thread-safe index of ``Image.perceptual_hash`` values.
+
+    -> *loader* returns ``(image_id, hex_hash)`` pairs; it is called once,
+       on the first query or insert.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Tuple[int, str]]]) -> None:
+        self._loader = loader
+        self._table: Optional[MultiIndexHashTable] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self) -> MultiIndexHashTable:
+        if self._table is None:
+            table = MultiIndexHashTable()
+            for image_id, hex_hash in self._loader():
+                if hex_hash:
+                    table.add(int(hex_hash, 16), image_id)
+            self._table = table
+        return self._table
+
+    def load(self) -> None:
+        """Load the index now rather than on first use."""
+        with self._lock:
+            self._ensure_loaded()
+
+    def add(self, image_id: int, hex_hash: str) -> None:
+        # The loader may already have picked up a freshly committed upload
+        with self._lock:
+            self._ensure_loaded().add(int(hex_hash, 16), image_id)
+
+    def near_duplicates(self, hex_hash: str, max_distance: int) -> List[Dict[str, int]]:
+        with self._lock:
+            matches = self._ensure_loaded().search(int(hex_hash, 16), max_distance)
+        return [{"image_id": image_id, "distance": distance} for image_id, distance in matches]
+
+    def reset(self) -> None:
+        """Drop the index so it is reloaded from the database on next use."""
+        with self._lock:
+            self._table = None
@@ -0,0 +1,8 @@
+-- Natural key used to upsert icons instead of creating one per annotation.
+-- Existing rows keep a NULL key until merge_duplicate_icons.py has run.
+BEGIN;
+
+ALTER TABLE icons ADD COLUMN IF NOT EXISTS natural_key TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS icons_natural_key_key ON icons (natural_key);
+
+COMMIT;
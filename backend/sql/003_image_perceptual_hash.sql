@@ -0,0 +1,7 @@
+-- 64-bit dHash of each upload, used for near-duplicate detection.
+-- Populate existing rows with backfill_phash.py.
+BEGIN;
+
+ALTER TABLE images ADD COLUMN IF NOT EXISTS perceptual_hash VARCHAR(16);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Outbox of Image / GestureInstance changes, read by the report backend's
+-- change feed. The backend also NOTIFYs on the change_events channel.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS change_events (
+    id BIGSERIAL PRIMARY KEY,
+    entity TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+COMMIT;
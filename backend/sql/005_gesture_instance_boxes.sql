@@ -0,0 +1,25 @@
+-- Queryable region geometry for gesture instances. Boxes are stored as
+-- fractions of the image size, matching utils.normalise_region.
+BEGIN;
+
+ALTER TABLE gesture_instances
+    ADD COLUMN IF NOT EXISTS box_x0 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS box_y0 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS box_x1 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS box_y1 DOUBLE PRECISION;
+
+UPDATE gesture_instances SET
+    box_x0 = LEAST((region_coordinates->>'x')::float,
+                   (region_coordinates->>'x')::float + (region_coordinates->>'width')::float) / 600,
+    box_x1 = GREATEST((region_coordinates->>'x')::float,
+                      (region_coordinates->>'x')::float + (region_coordinates->>'width')::float) / 600,
+    box_y0 = LEAST((region_coordinates->>'y')::float,
+                   (region_coordinates->>'y')::float + (region_coordinates->>'height')::float) / 400,
+    box_y1 = GREATEST((region_coordinates->>'y')::float,
+                      (region_coordinates->>'y')::float + (region_coordinates->>'height')::float) / 400
+WHERE box_x0 IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_gesture_instances_image_box
+    ON gesture_instances (image_id, box_x0, box_x1);
+
+COMMIT;
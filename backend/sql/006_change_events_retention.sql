@@ -0,0 +1,6 @@
+-- Supports pruning old change_events by age (change_feed.prune).
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS ix_change_events_created_at ON change_events (created_at);
+
+COMMIT;
@@ -0,0 +1,15 @@
+-- Records how far change_events has been pruned (change_feed.prune), so
+-- readers can tell a pruned range from ids skipped by rolled-back writes.
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS change_feed_state (
+    id SMALLINT PRIMARY KEY CHECK (id = 1),
+    pruned_through BIGINT NOT NULL DEFAULT 0
+);
+
+-- Earlier prunes left no marker; the lowest surviving id is the best bound.
+INSERT INTO change_feed_state (id, pruned_through)
+SELECT 1, COALESCE(MIN(id) - 1, 0) FROM change_events
+ON CONFLICT (id) DO NOTHING;
+
+COMMIT;
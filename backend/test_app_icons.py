@@ -0,0 +1,53 @@
+# backend/test_app_icons.py – icon cache behaviour of app._upsert_icon
+
+from unittest import mock
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def session(monkeypatch):
+    fake = mock.MagicMock()
+    monkeypatch.setattr(app, "db_session", fake)
+    app._icon_cache.clear()
+    yield fake
+    app._icon_cache.clear()
+
+
+def _cache(key, icon_id=7):
+    cached = app._CachedIcon.__new__(app._CachedIcon)
+    cached.id, cached.image_urls, cached.inscriptions = icon_id, {"u"}, set()
+    app._icon_cache.put(key, cached)
+    return cached
+
+
+def test_cache_hit_issues_only_the_guarded_update(session):
+    meta = {"title": "Hodegetria", "museum_collection_number": "M-1"}
+    cached = _cache("mcn:m-1")
+    session.query.return_value.filter.return_value.update.return_value = 1
+
+    assert app._upsert_icon(meta) is cached
+    values = session.query.return_value.filter.return_value.update.call_args.args[0]
+    assert values == {"title": "Hodegetria", "museum_collection_number": "M-1", "natural_key": "mcn:m-1"}
+    session.query.return_value.filter_by.assert_not_called()
+    session.begin_nested.assert_not_called()
+
+
+def test_stale_cache_entry_falls_back_to_lookup(session):
+    _cache("mcn:m-1")
+    session.query.return_value.filter.return_value.update.return_value = 0  # merged away
+    session.query.return_value.filter_by.return_value.first.return_value = mock.Mock(id=9)
+    session.query.return_value.filter_by.return_value.__iter__ = lambda self: iter([])
+
+    cached = app._upsert_icon({"title": "Hodegetria", "museum_collection_number": "M-1"})
+    assert cached.id == 9
+    assert app._icon_cache.get("mcn:m-1") is cached
+
+
+def test_rollback_forgets_cached_children(session):
+    _cache("mcn:m-1")
+    app._rollback()
+    session.rollback.assert_called_once()
+    assert app._icon_cache.get("mcn:m-1") is None
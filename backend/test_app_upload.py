@@ -0,0 +1,41 @@
+# backend/test_app_upload.py – upload_file() hashing edge cases
+
+import io
+from unittest import mock
+
+import pytest
+from PIL import Image as PILImage
+
+import app
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "UPLOAD_FOLDER", tmp_path)
+    monkeypatch.setattr(app, "db_session", mock.MagicMock())
+    monkeypatch.setattr(app, "phash_index", mock.MagicMock())
+    return app.app.test_client()
+
+
+def _png(size=(100, 100)):
+    buf = io.BytesIO()
+    PILImage.new("RGB", size, "white").save(buf, "PNG")
+    buf.seek(0)
+    return buf
+
+
+def test_oversized_scan_is_stored_without_hash(client, monkeypatch):
+    monkeypatch.setattr(PILImage, "MAX_IMAGE_PIXELS", 1000)
+    res = client.post("/upload", data={"file": (_png(), "scan.png")})
+
+    assert res.status_code == 200
+    assert res.get_json()["perceptual_hash"] is None
+    stored = app.db_session.add.call_args.args[0]
+    assert stored.filename == "scan.png" and stored.perceptual_hash is None
+    app.phash_index.add.assert_not_called()
+
+
+def test_non_image_upload_is_stored_without_hash(client):
+    res = client.post("/upload", data={"file": (io.BytesIO(b"not an image"), "notes.txt")})
+    assert res.status_code == 200
+    assert res.get_json()["perceptual_hash"] is None
@@ -0,0 +1,141 @@
+# backend/test_change_feed.py – outbox event collection and pruning bounds
+
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import change_feed
+from models import ChangeEvent, ChangeFeedState, Gesture, GestureInstance, Image
+
+
+def _session(new=(), dirty=(), deleted=(), modified=None):
+    """Session stand-in exposing the attributes _collect_events reads."""
+    modified = set(dirty) if modified is None else set(modified)
+    return SimpleNamespace(
+        new=list(new),
+        dirty=list(dirty),
+        deleted=list(deleted),
+        is_modified=lambda obj, include_collections=True: obj in modified,
+    )
+
+
+# --------------------------------------------------------------------------- #
+# _collect_events / _record_changes                                           #
+# --------------------------------------------------------------------------- #
+
+
+def test_collects_tracked_inserts_updates_and_deletes():
+    image = Image(id=1, filename="a.jpg")
+    inst = GestureInstance(id=5, image_id=1)
+    gone = GestureInstance(id=6, image_id=2)
+    session = _session(new=[image, Gesture(id=9, name="blessing")], dirty=[inst], deleted=[gone])
+
+    assert change_feed._collect_events(session) == [
+        {"entity": "image", "entity_id": 1, "op": "insert", "payload": {}},
+        {"entity": "gesture_instance", "entity_id": 5, "op": "update", "payload": {"image_id": 1}},
+        {"entity": "gesture_instance", "entity_id": 6, "op": "delete", "payload": {"image_id": 2}},
+    ]
+
+
+def test_dirty_objects_without_column_changes_are_skipped():
+    inst = GestureInstance(id=5, image_id=1)
+    assert change_feed._collect_events(_session(dirty=[inst], modified=[])) == []
+
+
+def test_record_changes_locks_before_inserting_and_notifies():
+    session = mock.MagicMock()
+    session.new = [Image(id=1, filename="a.jpg")]
+    session.dirty = session.deleted = []
+    conn = session.connection.return_value
+
+    change_feed._record_changes(session, None)
+
+    statements = [c.args[0] for c in conn.execute.call_args_list]
+    assert "pg_advisory_xact_lock" in str(statements[0])
+    assert statements[1].table is ChangeEvent.__table__
+    assert conn.execute.call_args_list[1].args[1][0]["op"] == "insert"
+    assert "pg_notify" in str(statements[2])
+
+
+def test_record_changes_without_events_leaves_the_connection_alone():
+    session = mock.MagicMock()
+    session.new = [Gesture(id=9, name="blessing")]
+    session.dirty = session.deleted = []
+
+    change_feed._record_changes(session, None)
+    session.connection.assert_not_called()
+
+
+# --------------------------------------------------------------------------- #
+# prune                                                                       #
+# --------------------------------------------------------------------------- #
+
+
+@pytest.mark.parametrize(
+    "expired, latest, keep_after, expected",
+    [
+        (None, 10, None, None),  # nothing old enough
+        (None, None, None, None),  # empty outbox
+        (5, 10, None, 5),
+        (10, 10, None, 9),  # everything expired: keep the newest event
+        (1, 1, None, None),  # only the newest event exists
+        (8, 10, 6, 6),  # incremental export still needs 7 onwards
+        (8, 10, 9, 8),  # keep_after above the expiry bound has no effect
+        (8, 10, 0, None),  # export has never run past 0
+    ],
+)
+def test_prune_bound(expired, latest, keep_after, expected):
+    assert change_feed._prune_bound(expired, latest, keep_after) == expected
+
+
+def _prune_session(expired, latest, state, deleted=3):
+    session = mock.MagicMock()
+    query = session.query.return_value
+    query.filter.return_value.scalar.return_value = expired
+    query.scalar.return_value = latest
+    query.filter.return_value.delete.return_value = deleted
+    session.get.return_value = state
+    return session
+
+
+def test_prune_records_bound_with_the_delete():
+    state = ChangeFeedState(id=1, pruned_through=2)
+    session = _prune_session(expired=10, latest=10, state=state)
+
+    assert change_feed.prune(session, keep_days=30, keep_after=7) == 3
+
+    session.get.assert_called_once_with(ChangeFeedState, 1, with_for_update=True)
+    assert state.pruned_through == 7
+    session.commit.assert_called_once()
+
+
+def test_prune_never_lowers_the_recorded_bound():
+    state = ChangeFeedState(id=1, pruned_through=8)
+    session = _prune_session(expired=5, latest=10, state=state)
+
+    change_feed.prune(session, keep_days=30)
+    assert state.pruned_through == 8
+
+
+def test_prune_creates_missing_state_row():
+    session = _prune_session(expired=5, latest=10, state=None)
+
+    change_feed.prune(session, keep_days=30)
+
+    state = session.add.call_args.args[0]
+    assert isinstance(state, ChangeFeedState) and state.pruned_through == 5
+
+
+def test_prune_with_nothing_to_delete_does_not_touch_state():
+    session = _prune_session(expired=None, latest=10, state=None)
+
+    assert change_feed.prune(session, keep_days=30) == 0
+    session.get.assert_not_called()
+    session.commit.assert_not_called()
+
+
+def test_pruned_through_defaults_to_zero():
+    session = mock.MagicMock()
+    session.query.return_value.filter_by.return_value.scalar.return_value = None
+    assert change_feed.pruned_through(session) == 0
@@ -0,0 +1,293 @@
+# backend/test_dataset_export.py – export pipeline, shutdown and validation
+
+import argparse
+import json
+import tarfile
+import threading
+from collections import defaultdict
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import dataset_export
+from dataset_export import ExportError
+
+
+@pytest.fixture
+def crops(tmp_path, monkeypatch):
+    folder = tmp_path / "crops"
+    folder.mkdir()
+    monkeypatch.setattr(dataset_export, "CROPS_FOLDER", folder)
+    return folder
+
+
+def _rows(crops, count, missing=()):
+    for i in range(count):
+        name = f"c{i}.jpg"
+        if i not in missing:
+            (crops / name).write_bytes(b"jpeg" * (i + 1))
+        yield {"gesture_instance_id": i, "gesture": "blessing", "cropped_image_path": name}
+
+
+def _run(rows, run_dir, shard_size=2, workers=3, queue_size=4):
+    """Run the pipeline in a thread so a hang fails the test instead of the suite."""
+    stats = defaultdict(int)
+    outcome = {}
+
+    def target():
+        try:
+            dataset_export._run_pipeline(rows, run_dir, shard_size, workers, queue_size, stats)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), "pipeline did not shut down"
+    return stats, outcome.get("error")
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+def test_pipeline_writes_shards_and_manifest(tmp_path, crops):
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+    stats, error = _run(_rows(crops, 7, missing={3, 5}), run_dir)
+
+    assert error is None
+    assert stats["samples"] == 5 and stats["missing_crops"] == 2 and stats["shards"] == 3
+
+    manifest = [json.loads(l) for l in (run_dir / "manifest.jsonl").read_text().splitlines()]
+    assert sorted(m["key"] for m in manifest) == [f"{i:09d}" for i in (0, 1, 2, 4, 6)]
+    assert all("cropped_image_path" not in m for m in manifest)
+
+    names = []
+    for shard in sorted(run_dir.glob("shard-*.tar")):
+        with tarfile.open(shard) as tar:
+            assert len(tar.getnames()) <= 4  # two samples of two files
+            names += tar.getnames()
+    assert f"{4:09d}.jpg" in names and f"{4:09d}.json" in names
+
+
+def test_pipeline_stops_when_row_source_fails(tmp_path, crops):
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+
+    def rows():
+        yield from _rows(crops, 20)
+        raise RuntimeError("cursor lost")
+
+    _, error = _run(rows(), run_dir)
+    assert isinstance(error, ExportError)
+    assert "cursor lost" in str(error)
+
+
+def test_pipeline_stops_when_writer_fails(tmp_path, crops):
+    # No run directory: the first shard cannot be opened
+    _, error = _run(_rows(crops, 50), tmp_path / "missing")
+    assert isinstance(error, ExportError)
+    assert isinstance(error.__cause__, OSError)
+
+
+def test_pipeline_stops_when_reader_fails(tmp_path, crops):
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+
+    def rows():
+        yield from _rows(crops, 10)
+        yield {"gesture_instance_id": 99, "cropped_image_path": 123}  # not a path
+        yield from _rows(crops, 50)
+
+    _, error = _run(rows(), run_dir)
+    assert isinstance(error, ExportError)
+    assert isinstance(error.__cause__, TypeError)
+
+
+# ---------------------------------------------------------------------------
+# Validation, locking and run bookkeeping
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("option", ["workers", "shard_size", "queue_size", "yield_per"])
+@pytest.mark.parametrize("value", [0, -1])
+def test_export_rejects_non_positive_options(tmp_path, option, value):
+    with pytest.raises(ValueError, match=option):
+        dataset_export.export_dataset(tmp_path / "out", **{option: value})
+    assert not (tmp_path / "out").exists()
+
+
+def test_command_line_rejects_zero_workers():
+    with pytest.raises(argparse.ArgumentTypeError):
+        dataset_export._positive_int("0")
+    assert dataset_export._positive_int("3") == 3
+
+
+def test_only_one_run_per_output_folder(tmp_path):
+    with dataset_export._exclusive(tmp_path):
+        with pytest.raises(ExportError, match="already running"):
+            with dataset_export._exclusive(tmp_path):
+                pass
+    with dataset_export._exclusive(tmp_path):
+        pass  # released again
+
+
+def test_run_ids_are_unique_within_a_second():
+    assert len({dataset_export._new_run_id() for _ in range(100)}) == 100
+
+
+def test_label_signatures_track_renames_and_label_edits():
+    names = {1: "blessing", 2: "orans"}
+    labels = {1: [{"system": "A", "label": "x"}, {"system": "B", "label": "y"}]}
+    base = dataset_export._label_signatures(names, labels)
+
+    reordered = {1: list(reversed(labels[1]))}
+    assert dataset_export._label_signatures(names, reordered) == base
+
+    renamed = dataset_export._label_signatures({**names, 2: "orant"}, labels)
+    assert renamed["1"] == base["1"] and renamed["2"] != base["2"]
+
+    relabelled = dataset_export._label_signatures(
+        names, {1: [{"system": "A", "label": "z"}, {"system": "B", "label": "y"}]}
+    )
+    assert relabelled["1"] != base["1"] and relabelled["2"] == base["2"]
+
+
+# ---------------------------------------------------------------------------
+# Icons
+# ---------------------------------------------------------------------------
+
+NUMBERED = {"title": "Hodegetria", "museum_collection_number": "B-12"}
+UNNUMBERED = {"title": "Hodegetria"}
+
+
+def _icon(natural_key, title="Hodegetria", inscriptions=(), images=()):
+    fields = dict.fromkeys(dataset_export.ICON_EXPORT_FIELDS)
+    fields["title"] = title
+    return SimpleNamespace(
+        natural_key=natural_key,
+        images=[SimpleNamespace(image_url=u) for u in images],
+        inscriptions=[
+            SimpleNamespace(**{**dict.fromkeys(dataset_export.INSCRIPTION_EXPORT_FIELDS), **i})
+            for i in inscriptions
+        ],
+        **fields,
+    )
+
+
+def _load(*icons):
+    session = mock.MagicMock()
+    session.query.return_value.filter.return_value.options.return_value = list(icons)
+    return dataset_export._load_icons(session)
+
+
+def _instance(id, icon_meta=None, picked=True):
+    return SimpleNamespace(
+        id=id, image_id=1, filename="a.jpg", gesture_id=2, name="blessing",
+        region_coordinates=None, box_x0=0, box_y0=0, box_x1=1, box_y1=1,
+        notes=json.dumps({"icon": icon_meta}) if icon_meta else "plain note",
+        cropped_image_path=f"c{id}.jpg", picked=picked,
+    )
+
+
+def _iter(rows, icons, changed_icons=None):
+    session = mock.MagicMock()
+    session.execute.return_value = rows
+    stats = defaultdict(int)
+    out = list(
+        dataset_export._iter_rows(session, mock.MagicMock(), {}, icons, 10, stats, changed_icons)
+    )
+    return out, stats
+
+
+def test_icon_keys_try_collection_number_then_content():
+    mcn, content = dataset_export._icon_keys(NUMBERED)
+    assert mcn == "mcn:b-12" and content.startswith("sha256:")
+    assert dataset_export._icon_keys(UNNUMBERED) == (content,)
+    assert dataset_export._icon_keys(None) == ()
+
+
+def test_rows_carry_the_stored_icon_not_the_notes():
+    mcn, content = dataset_export._icon_keys(NUMBERED)
+    icons = _load(
+        _icon(mcn, title="Hodegetria (restored)",
+              inscriptions=[{"language": "el", "text": "MP ΘY"}], images=["b.jpg", "a.jpg"]),
+    )
+    (row,), stats = _iter([_instance(1, NUMBERED)], icons)
+
+    assert row["icon_key"] == mcn
+    assert row["icon"]["title"] == "Hodegetria (restored)"
+    assert row["icon"]["images"] == ["a.jpg", "b.jpg"]
+    assert row["icon"]["inscriptions"][0]["text"] == "MP ΘY"
+    assert stats["unresolved_icons"] == 0
+
+
+def test_numbered_notes_fall_back_to_content_keyed_icon():
+    _, content = dataset_export._icon_keys(NUMBERED)
+    (row,), _ = _iter([_instance(1, NUMBERED)], _load(_icon(content)))
+    assert row["icon_key"] == content
+
+
+def test_unresolved_icons_are_counted():
+    rows, stats = _iter([_instance(1, UNNUMBERED), _instance(2)], {})
+    assert [r["icon"] for r in rows] == [None, None]
+    assert stats["unresolved_icons"] == 1  # the plain note has no icon
+
+
+def test_changed_icons_select_unpicked_instances():
+    (key,) = dataset_export._icon_keys(UNNUMBERED)
+    icons = _load(_icon(key))
+    rows = [
+        _instance(1, UNNUMBERED, picked=False),  # icon edited
+        _instance(2, picked=False),  # untouched
+        _instance(3, picked=True),  # changed instance
+    ]
+    out, _ = _iter(rows, icons, changed_icons={key})
+    assert [r["gesture_instance_id"] for r in out] == [1, 3]
+
+
+def test_icon_signatures_track_field_and_inscription_edits():
+    base = dataset_export._icon_signatures(_load(_icon("k1"), _icon("k2")))
+
+    retitled = dataset_export._icon_signatures(_load(_icon("k1", title="Eleousa"), _icon("k2")))
+    assert retitled["k1"] != base["k1"] and retitled["k2"] == base["k2"]
+
+    inscribed = dataset_export._icon_signatures(
+        _load(_icon("k1"), _icon("k2", inscriptions=[{"text": "IC XC"}]))
+    )
+    assert inscribed["k1"] == base["k1"] and inscribed["k2"] != base["k2"]
+
+
+def test_export_route_rejects_non_positive_options():
+    from app import app
+
+    client = app.test_client()
+    for body in ({"workers": 0}, {"shard_size": -5}, {"workers": "many"}):
+        assert client.post("/exports", json=body).status_code == 400
+
+
+@pytest.mark.parametrize("value", ["false", "0", 0, None, []])
+def test_export_route_requires_boolean_incremental(value):
+    from app import app
+
+    res = app.test_client().post("/exports", json={"incremental": value})
+    assert res.status_code == 400
+
+
+def test_export_downloads_are_limited_to_recorded_runs(tmp_path, monkeypatch):
+    from app import app
+
+    monkeypatch.setattr(dataset_export, "EXPORTS_FOLDER", tmp_path)
+    for run_id in ("done", "failed"):
+        (tmp_path / run_id).mkdir()
+        (tmp_path / run_id / "manifest.jsonl").write_text("{}\n")
+    dataset_export._save_state(tmp_path, {"version": 3, "runs": [{"run_id": "done"}]})
+    (tmp_path / ".lock").write_text("")
+    client = app.test_client()
+
+    assert client.get("/exports/done/manifest.jsonl").status_code == 200
+    assert client.get("/exports/failed/manifest.jsonl").status_code == 404
+    assert client.get("/exports/state.json").status_code == 404
+    assert client.get("/exports/.lock").status_code == 404
+    assert client.get("/exports/done/../state.json").status_code == 404
@@ -0,0 +1,35 @@
+# backend/test_merge_duplicate_icons.py – grouping rules of the icon merge job
+
+from types import SimpleNamespace
+
+from merge_duplicate_icons import ICON_KEY_FIELDS, group_icons
+
+
+def _icon(id, **fields):
+    values = {f: None for f in ICON_KEY_FIELDS}
+    values.update(fields)
+    return SimpleNamespace(id=id, **values)
+
+
+def test_groups_identical_icons_oldest_first():
+    icons = [_icon(3, title="A"), _icon(1, title="a"), _icon(2, title="B")]
+    groups = group_icons(icons)
+    assert sorted([i.id for i in g] for g in groups.values()) == [[1, 3], [2]]
+
+
+def test_unnumbered_icon_joins_numbered_icon_with_same_content():
+    icons = [_icon(1, title="A"), _icon(2, title="A", museum_collection_number="M-7")]
+    groups = group_icons(icons)
+    assert list(groups) == ["mcn:m-7"]
+    assert [i.id for i in groups["mcn:m-7"]] == [1, 2]
+
+
+def test_unnumbered_icon_joins_oldest_of_several_numbered_icons():
+    icons = [
+        _icon(1, title="A"),
+        _icon(5, title="A", museum_collection_number="M-2"),
+        _icon(4, title="A", museum_collection_number="M-1"),
+    ]
+    groups = group_icons(icons)
+    assert [i.id for i in groups["mcn:m-1"]] == [1, 4]
+    assert [i.id for i in groups["mcn:m-2"]] == [5]
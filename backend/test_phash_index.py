@@ -0,0 +1,76 @@
+# backend/test_phash_index.py – near-duplicate index behaviour
+
+import random
+
+import pytest
+
+from phash_index import MultiIndexHashTable, PHashIndex
+from utils import hamming_distance
+
+
+def _flip(value, bits):
+    for b in bits:
+        value ^= 1 << b
+    return value
+
+
+@pytest.mark.parametrize("radius", [0, 3, 7, 10])
+def test_search_matches_brute_force(radius):
+    rng = random.Random(radius)
+    values = [rng.getrandbits(64) for _ in range(2000)]
+    # Plant neighbours at every distance up to radius + 2
+    values += [_flip(values[i], rng.sample(range(64), i % (radius + 3))) for i in range(200)]
+    table = MultiIndexHashTable()
+    for item_id, value in enumerate(values):
+        table.add(value, item_id)
+
+    for query in values[:50]:
+        expected = sorted(
+            (i, hamming_distance(query, v))
+            for i, v in enumerate(values)
+            if hamming_distance(query, v) <= radius
+        )
+        assert sorted(table.search(query, radius)) == expected
+
+
+def test_search_orders_nearest_first():
+    table = MultiIndexHashTable()
+    table.add(_flip(0, [1, 2, 3]), 1)
+    table.add(_flip(0, [5]), 2)
+    table.add(0, 3)
+    assert table.search(0, 7) == [(3, 0), (2, 1), (1, 3)]
+
+
+def test_add_ignores_known_ids():
+    table = MultiIndexHashTable()
+    assert table.add(42, 1)
+    assert not table.add(42, 1)
+    assert len(table) == 1
+    assert table.search(42, 0) == [(1, 0)]
+
+
+def test_rejects_uneven_chunks():
+    with pytest.raises(ValueError):
+        MultiIndexHashTable(bits=64, chunks=5)
+
+
+def test_index_loads_lazily_and_once():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [(1, "00000000000000ff"), (2, None)]
+
+    index = PHashIndex(loader)
+    assert calls == []
+    assert index.near_duplicates("00000000000000fe", 2) == [{"image_id": 1, "distance": 1}]
+    index.near_duplicates("00000000000000fe", 2)
+    assert calls == [1]
+
+
+def test_add_after_loader_saw_the_upload_does_not_duplicate():
+    # The upload commits, the background loader reads it, then add() runs
+    index = PHashIndex(lambda: [(7, "0123456789abcdef")])
+    index.load()
+    index.add(7, "0123456789abcdef")
+    assert index.near_duplicates("0123456789abcdef", 0) == [{"image_id": 7, "distance": 0}]
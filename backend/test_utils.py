@@ -0,0 +1,160 @@
+# backend/test_utils.py – unit tests for the pure helpers in utils.py
+
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image as PILImage
+
+from utils import (
+    LRUCache,
+    box_iou,
+    dhash,
+    hamming_distance,
+    icon_content_key,
+    icon_natural_key,
+    inscription_key,
+    normalise_region,
+    save_crop,
+)
+
+
+# ---------------------------------------------------------------------------
+# Icon identity
+# ---------------------------------------------------------------------------
+
+def test_icon_natural_key_prefers_collection_number():
+    key = icon_natural_key({"museum_collection_number": "  AB 12 ", "title": "Hodegetria"})
+    assert key == "mcn:ab 12"
+    assert key == icon_natural_key({"museum_collection_number": "ab  12", "title": "Other"})
+
+
+def test_icon_natural_key_falls_back_to_content_key():
+    meta = {"title": "Virgin Hodegetria", "culture_period": "Cretan"}
+    assert icon_natural_key(meta) == icon_content_key(meta)
+    assert icon_natural_key(meta).startswith("sha256:")
+
+
+def test_icon_content_key_normalises_and_ignores_non_identity_fields():
+    a = {"title": "Virgin  Hodegetria", "condition_report": "flaking"}
+    b = {"title": "virgin hodegetria", "object_type": "icon", "museum_collection_number": "X1"}
+    assert icon_content_key(a) == icon_content_key(b)
+    assert icon_content_key(a) != icon_content_key({"title": "Pantocrator"})
+
+
+def test_inscription_key_ignores_case_and_whitespace():
+    a = SimpleNamespace(language="Greek", text="ΜΡ  ΘΥ", location_on_icon="top", translation="x")
+    b = SimpleNamespace(language="greek", text="μρ θυ", location_on_icon="Top ", translation=None)
+    assert inscription_key(a) == inscription_key(b)
+
+
+# ---------------------------------------------------------------------------
+# LRUCache
+# ---------------------------------------------------------------------------
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now oldest
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.discard("a")
+    assert cache.get("a") is None
+
+
+# ---------------------------------------------------------------------------
+# Perceptual hashing
+# ---------------------------------------------------------------------------
+
+def _gradient(path, size, fmt):
+    img = PILImage.new("L", size)
+    w, h = size
+    img.putdata([(x * 255 // w + (y * 97 // h)) % 256 for y in range(h) for x in range(w)])
+    img.convert("RGB").save(path, fmt)
+    return path
+
+
+def test_hamming_distance():
+    assert hamming_distance(0b1011, 0b0001) == 2
+    assert hamming_distance(2**64 - 1, 0) == 64
+
+
+def test_dhash_is_64_bit_hex(tmp_path):
+    value = dhash(_gradient(tmp_path / "a.png", (120, 80), "PNG"))
+    assert len(value) == 16
+    int(value, 16)
+
+
+def test_dhash_survives_rescaling_and_reencoding(tmp_path):
+    original = dhash(_gradient(tmp_path / "a.png", (600, 400), "PNG"))
+    smaller = dhash(_gradient(tmp_path / "b.jpg", (150, 100), "JPEG"))
+    assert hamming_distance(int(original, 16), int(smaller, 16)) <= 7
+
+
+def test_dhash_separates_different_images(tmp_path):
+    a = dhash(_gradient(tmp_path / "a.png", (600, 400), "PNG"))
+    flipped = PILImage.open(tmp_path / "a.png").transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)
+    flipped.save(tmp_path / "b.png")
+    b = dhash(tmp_path / "b.png")
+    assert hamming_distance(int(a, 16), int(b, 16)) > 7
+
+
+# ---------------------------------------------------------------------------
+# Region geometry
+# ---------------------------------------------------------------------------
+
+def test_normalise_region_scales_ui_coordinates():
+    assert normalise_region({"x": 60, "y": 40, "width": 300, "height": 200}) == (
+        0.1, 0.1, 0.6, 0.6
+    )
+
+
+def test_normalise_region_handles_negative_drags():
+    dragged_back = {"x": 360, "y": 240, "width": -300, "height": -200}
+    assert normalise_region(dragged_back) == pytest.approx((0.1, 0.1, 0.6, 0.6))
+
+
+def test_normalise_region_rejects_incomplete_input():
+    with pytest.raises(KeyError):
+        normalise_region({"x": 1, "y": 2, "width": 3})
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        ((0, 0, 1, 1), (0, 0, 1, 1), 1.0),
+        ((0, 0, 1, 1), (0.5, 0, 1.5, 1), 1 / 3),
+        ((0, 0, 1, 1), (1, 0, 2, 1), 0.0),  # touching edges only
+        ((0, 0, 1, 1), (2, 2, 3, 3), 0.0),
+        ((0, 0, 1, 1), (0.25, 0.25, 0.75, 0.75), 0.25),
+        ((0, 0, 0, 0), (0, 0, 0, 0), 0.0),  # degenerate boxes
+    ],
+)
+def test_box_iou(a, b, expected):
+    assert box_iou(a, b) == pytest.approx(expected)
+    assert box_iou(b, a) == pytest.approx(expected)
+
+
+def test_save_crop_uses_normalised_region(tmp_path):
+    PILImage.new("RGB", (1200, 800)).save(tmp_path / "scan.png")
+    name = save_crop(
+        tmp_path / "scan.png", {"x": 360, "y": 240, "width": -300, "height": -200}, tmp_path
+    )
+    width, height = PILImage.open(tmp_path / name).size
+    assert abs(width - 600) <= 1 and abs(height - 400) <= 1  # int() truncation
+
+
+def test_dhash_of_large_jpeg_matches_its_downscaled_copy(tmp_path):
+    # Exercises the draft (reduced-scale) JPEG decode path
+    big = dhash(_gradient(tmp_path / "big.jpg", (4000, 2666), "JPEG"))
+    small = dhash(_gradient(tmp_path / "small.png", (300, 200), "PNG"))
+    assert hamming_distance(int(big, 16), int(small, 16)) <= 7
+
+
+def test_dhash_raises_decompression_bomb_error(tmp_path, monkeypatch):
+    path = _gradient(tmp_path / "a.png", (100, 100), "PNG")
+    monkeypatch.setattr(PILImage, "MAX_IMAGE_PIXELS", 1000)  # errors above 2x
+    with pytest.raises(PILImage.DecompressionBombError):
+        dhash(path)
@@ -1,19 +1,19 @@
 # backend/utils.py
 
+from collections import OrderedDict
 from PIL import Image as PILImage
+import hashlib
+import json
 import os
+import threading
 import uuid
 
-def save_crop(original_path, rect, dest_folder):
+def normalise_region(rect):
     """
-    Crops the region from original_path based on rect, saves to dest_folder.
-    rect: {x, y, width, height} in 600x400 UI coordinates.
-    Returns the saved filename.
+    Converts rect ({x, y, width, height} in 600x400 UI coordinates, possibly
+    dragged with negative width/height) into an (x0, y0, x1, y1) box of
+    fractions of the image size, with x0 <= x1 and y0 <= y1.
     """
-    img = PILImage.open(original_path)
-    ow, oh = img.size
-
-    # Convert UI (600x400) coordinates to image coordinates
     sx, sy = rect["x"] / 600, rect["y"] / 400
     sw, sh = rect["width"] / 600, rect["height"] / 400
 
@@ -25,11 +25,37 @@ def save_crop(original_path, rect, dest_folder):
         sy += sh
         sh = -sh
 
+    return sx, sy, sx + sw, sy + sh
+
+
+def box_iou(a, b):
+    """
+    Returns the intersection-over-union of two (x0, y0, x1, y1) boxes.
+    """
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def save_crop(original_path, rect, dest_folder):
+    """
+    Crops the region from original_path based on rect, saves to dest_folder.
+    rect: {x, y, width, height} in 600x400 UI coordinates.
+    Returns the saved filename.
+    """
+    img = PILImage.open(original_path)
+    ow, oh = img.size
+
+    x0, y0, x1, y1 = normalise_region(rect)
     box = (
-        int(sx * ow),
-        int(sy * oh),
-        int((sx + sw) * ow),
-        int((sy + sh) * oh),
+        int(x0 * ow),
+        int(y0 * oh),
+        int(x1 * ow),
+        int(y1 * oh),
     )
 
     crop = img.crop(box)
@@ -37,3 +63,131 @@ def save_crop(original_path, rect, dest_folder):
     dest_path = os.path.join(dest_folder, filename)
     crop.save(dest_path, quality=90)
     return filename
+
+def dhash(image_path, hash_size=8):
+    """
+    Computes a difference hash (dHash) of the image at image_path.
+    The image is reduced to a (hash_size + 1) x hash_size greyscale thumbnail
+    and each bit records whether a pixel is brighter than its right-hand
+    neighbour, so the hash survives rescaling and re-encoding.
+    Returns the hash as a zero-padded hex string.
+    """
+    with PILImage.open(image_path) as img:
+        # Let JPEGs decode at a reduced scale instead of full resolution
+        img.draft("L", (hash_size + 1, hash_size))
+        thumb = img.convert("L").resize(
+            (hash_size + 1, hash_size), PILImage.Resampling.LANCZOS
+        )
+        pixels = list(thumb.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(a, b):
+    """
+    Returns the number of differing bits between two integer hashes.
+    """
+    return bin(a ^ b).count("1")
+
+
+# ---------------------------------------------------------------------------
+# Icon identity helpers
+# ---------------------------------------------------------------------------
+
+# Fields that describe *which* icon this is, as opposed to its condition or
+# provenance notes, which may legitimately change between submissions.
+ICON_IDENTITY_FIELDS = (
+    "iconographic_variant_id",
+    "title",
+    "object_type",
+    "culture_period",
+    "date_approx",
+    "place_of_creation",
+    "current_location",
+    "dimensions_mm",
+)
+
+
+def _normalise(value):
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, (list, tuple)):
+        return [_normalise(v) for v in value]
+    return value
+
+
+def icon_content_key(icon_meta):
+    """
+    Returns a SHA-256 key over the normalised identity fields of icon_meta,
+    ignoring the museum collection number.
+    """
+    identity = {field: _normalise(icon_meta.get(field)) for field in ICON_IDENTITY_FIELDS}
+    identity["object_type"] = identity["object_type"] or "icon"
+    digest = hashlib.sha256(
+        json.dumps(identity, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return f"sha256:{digest}"
+
+
+def icon_natural_key(icon_meta):
+    """
+    Returns a stable identity key for an icon described by icon_meta (a dict
+    of Icon column values).
+    The museum collection number is preferred; otherwise the content key
+    (see icon_content_key) is used.
+    """
+    collection_number = (icon_meta.get("museum_collection_number") or "").strip()
+    if collection_number:
+        return f"mcn:{_normalise(collection_number)}"
+    return icon_content_key(icon_meta)
+
+def inscription_key(inscription):
+    """
+    Returns the identity of an IconInscription, used to merge inscriptions
+    rather than store the same one twice against an icon.
+    """
+    return (
+        _normalise(inscription.language),
+        _normalise(inscription.text),
+        _normalise(inscription.location_on_icon),
+    )
+
+
+class LRUCache:
+    """
+    Small thread-safe least-recently-used mapping.
+    Used to remember recently resolved ids so bursts of requests referring
+    to the same record skip the database lookup.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -1,9 +1,12 @@
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
-from models import Base, Image, GestureInstance, Gesture
+from models import Base, Image, GestureInstance, Gesture, ChangeEvent, ChangeFeedState
 import os
+import select
+import threading
+import time
 
 app = Flask(__name__)
 CORS(app)
@@ -41,6 +44,159 @@ def get_images():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Change feed: clients load /report/api/images once, then long-poll
+# /report/api/changes?since=<version> and apply the returned deltas.
+NOTIFY_CHANNEL = 'change_events'
+MAX_WAIT_SECONDS = 30
+MAX_EVENTS = 500
+
+_changed = threading.Condition()
+_generation = 0  # bumped on every notification
+_listener_started = False
+
+
+def _listen_for_changes():
+    """Wake waiting long-polls whenever the annotation backend commits a change."""
+    global _generation
+    while True:
+        try:
+            conn = engine.raw_connection()
+            try:
+                conn.driver_connection.autocommit = True
+                cur = conn.cursor()
+                cur.execute('LISTEN ' + NOTIFY_CHANNEL)
+                while True:
+                    if select.select([conn.driver_connection], [], [], MAX_WAIT_SECONDS) == ([], [], []):
+                        continue
+                    conn.driver_connection.poll()
+                    if conn.driver_connection.notifies:
+                        conn.driver_connection.notifies.clear()
+                        with _changed:
+                            _generation += 1
+                            _changed.notify_all()
+            finally:
+                conn.invalidate()
+        except Exception as e:
+            app.logger.error(f'Change listener error: {e}')
+            time.sleep(5)
+
+
+def _ensure_listener():
+    global _listener_started
+    with _changed:
+        if not _listener_started:
+            threading.Thread(target=_listen_for_changes, daemon=True).start()
+            _listener_started = True
+
+
+def _serialise_instance(inst, gesture_names):
+    return {
+        'id': inst.id,
+        'image_id': inst.image_id,
+        'region_coordinates': inst.region_coordinates,
+        'notes': inst.notes,
+        'gesture': gesture_names.get(inst.gesture_id),
+        'gesture_id': inst.gesture_id
+    }
+
+
+def _serialise_image(img):
+    return {
+        'id': img.id,
+        'filename': img.filename,
+        'upload_timestamp': img.upload_timestamp.isoformat() if img.upload_timestamp else None
+    }
+
+
+def _load_events(db, since):
+    events = (
+        db.query(ChangeEvent)
+        .filter(ChangeEvent.id > since)
+        .order_by(ChangeEvent.id)
+        .limit(MAX_EVENTS)
+        .all()
+    )
+    if not events:
+        return []
+
+    # Send current row state rather than the outbox payload so deltas match
+    # the /report/api/images shape; rows deleted since are sent as None.
+    wanted = {'image': set(), 'gesture_instance': set()}
+    for ev in events:
+        if ev.op != 'delete':
+            wanted[ev.entity].add(ev.entity_id)
+    images = {}
+    if wanted['image']:
+        images = {img.id: _serialise_image(img)
+                  for img in db.query(Image).filter(Image.id.in_(wanted['image']))}
+    instances = {}
+    if wanted['gesture_instance']:
+        gesture_names = dict(db.query(Gesture.id, Gesture.name))
+        instances = {inst.id: _serialise_instance(inst, gesture_names)
+                     for inst in db.query(GestureInstance).filter(GestureInstance.id.in_(wanted['gesture_instance']))}
+    rows = {'image': images, 'gesture_instance': instances}
+
+    return [{
+        'version': ev.id,
+        'entity': ev.entity,
+        'op': ev.op,
+        'id': ev.entity_id,
+        'data': None if ev.op == 'delete' else rows[ev.entity].get(ev.entity_id),
+        'image_id': (ev.payload or {}).get('image_id')
+    } for ev in events]
+
+
+def _pruned_through(db):
+    """Highest event id pruned from the outbox (see backend/change_feed.py)."""
+    return db.query(ChangeFeedState.pruned_through).filter_by(id=1).scalar() or 0
+
+
+def _needs_reset(since, latest, pruned):
+    # since > latest: the outbox was recreated; since < pruned: events the
+    # client still needed are gone. Ids skipped by rolled-back writes are not
+    # a reason to reset, so compare against the recorded prune bound.
+    return since > latest or since < pruned
+
+
+@app.route('/report/api/changes', methods=['GET'])
+def get_changes():
+    """Long-poll for changes after ``since``.
+
+    Without ``since`` the current version is returned immediately; fetch it
+    before /report/api/images so no change falls between the two.
+    """
+    try:
+        with Session() as db:
+            latest = db.query(func.coalesce(func.max(ChangeEvent.id), 0)).scalar()
+            since = request.args.get('since', type=int)
+            if since is None or _needs_reset(since, latest, _pruned_through(db)):
+                # First call, or the client must reload
+                return jsonify({'version': latest, 'events': [], 'reset': since is not None}), 200
+
+            _ensure_listener()
+            timeout = min(request.args.get('timeout', MAX_WAIT_SECONDS, type=float), MAX_WAIT_SECONDS)
+            deadline = time.monotonic() + timeout
+            while True:
+                with _changed:
+                    seen = _generation
+                events = _load_events(db, since)
+                # A prune may have committed since the check above; it records
+                # its bound atomically with the delete, so reading it after the
+                # events shows whether any were removed from under us.
+                if since < _pruned_through(db):
+                    return jsonify({'version': latest, 'events': [], 'reset': True}), 200
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    break
+                db.rollback()  # end the snapshot so the next query sees new commits
+                with _changed:
+                    _changed.wait_for(lambda: _generation != seen, remaining)
+
+            version = events[-1]['version'] if events else since
+            return jsonify({'version': version, 'events': events, 'reset': False}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/uploads/<path:filename>')
 def serve_uploaded_file(filename):
     uploads_dir = os.path.join(os.path.dirname(__file__), '..', 'backend', 'uploads')
@@ -0,0 +1,7 @@
+# report_backend/conftest.py – shared pytest setup for the report backend tests
+
+import os
+
+# models.py refuses to import without a DATABASE_URL. The unit tests never
+# connect, so any well-formed URL will do.
+os.environ.setdefault("DATABASE_URL", "postgresql://annotator@localhost/gesture_test")
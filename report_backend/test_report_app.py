@@ -0,0 +1,105 @@
+# report_backend/test_report_app.py – /report/api/changes reset, limit and version
+
+from contextlib import nullcontext
+from unittest import mock
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    """Stub the database behind get_changes; returns the knobs tests turn."""
+    db = mock.MagicMock()
+    state = {"latest": 10, "pruned": 0, "events": []}
+    db.query.return_value.scalar.side_effect = lambda: state["latest"]
+    monkeypatch.setattr(app, "Session", lambda: nullcontext(db))
+    monkeypatch.setattr(app, "_pruned_through", lambda _db: state["pruned"])
+    monkeypatch.setattr(app, "_load_events", lambda _db, since: state["events"])
+    monkeypatch.setattr(app, "_ensure_listener", lambda: None)
+    state["client"] = app.app.test_client()
+    return state
+
+
+def _event(version):
+    return {"version": version, "entity": "image", "op": "insert", "id": version,
+            "data": {}, "image_id": None}
+
+
+def _get(feed, **params):
+    res = feed["client"].get("/report/api/changes", query_string={"timeout": 0, **params})
+    assert res.status_code == 200
+    return res.get_json()
+
+
+def test_first_call_returns_current_version(feed):
+    assert _get(feed) == {"version": 10, "events": [], "reset": False}
+
+
+def test_since_ahead_of_outbox_resets(feed):
+    assert _get(feed, since=11)["reset"] is True
+
+
+def test_since_behind_pruned_range_resets(feed):
+    feed["pruned"] = 6
+    body = _get(feed, since=5)
+    assert body == {"version": 10, "events": [], "reset": True}
+
+
+def test_gap_below_oldest_event_is_not_a_reset(feed):
+    # Ids 1-7 were never committed (rolled back); nothing was pruned
+    feed["events"] = [_event(8)]
+    body = _get(feed, since=0)
+    assert body["reset"] is False and body["version"] == 8
+
+
+def test_since_at_pruned_bound_is_caught_up(feed):
+    feed["pruned"] = 6
+    feed["events"] = [_event(7), _event(9)]
+    body = _get(feed, since=6)
+    assert body["reset"] is False
+    assert [e["version"] for e in body["events"]] == [7, 9]
+    assert body["version"] == 9
+
+
+def test_prune_during_poll_resets(feed, monkeypatch):
+    calls = iter([0, 6])  # before and after loading events
+    monkeypatch.setattr(app, "_pruned_through", lambda _db: next(calls))
+    feed["events"] = [_event(8)]
+    assert _get(feed, since=5)["reset"] is True
+
+
+def test_no_events_keeps_client_version(feed):
+    assert _get(feed, since=10) == {"version": 10, "events": [], "reset": False}
+
+
+def test_timeout_is_capped(feed, monkeypatch):
+    monkeypatch.setattr(app, "MAX_WAIT_SECONDS", 0)
+    assert _get(feed, since=10, timeout=3600)["version"] == 10
+
+
+def test_load_events_is_limited():
+    db = mock.MagicMock()
+    chain = db.query.return_value.filter.return_value.order_by.return_value
+    chain.limit.return_value.all.return_value = []
+
+    assert app._load_events(db, 4) == []
+    chain.limit.assert_called_once_with(app.MAX_EVENTS)
+
+
+def test_load_events_serialises_current_rows():
+    db = mock.MagicMock()
+    events = [
+        mock.Mock(id=3, entity="image", op="insert", entity_id=1, payload={}),
+        mock.Mock(id=4, entity="image", op="delete", entity_id=2, payload={}),
+    ]
+    chain = db.query.return_value.filter.return_value.order_by.return_value
+    chain.limit.return_value.all.return_value = events
+    image = mock.Mock(id=1, filename="a.jpg", upload_timestamp=None)
+    db.query.return_value.filter.return_value.__iter__ = lambda self: iter([image])
+
+    out = app._load_events(db, 2)
+    assert [e["version"] for e in out] == [3, 4]
+    assert out[0]["data"] == {"id": 1, "filename": "a.jpg", "upload_timestamp": None}
+    assert out[1]["data"] is None
@@ -2,29 +2,102 @@
 import React, { useEffect, useState } from 'react';
 import axios from 'axios';
 
+const API_BASE = 'http://35.176.15.104:5001';
+
+/* Apply change-feed events to the image list (newest event wins). */
+function applyChanges(images, events) {
+  let next = images;
+  for (const ev of events) {
+    if (ev.entity === 'image') {
+      const rest = next.filter((img) => img.id !== ev.id);
+      if (ev.op === 'delete' || !ev.data) {
+        next = rest;
+      } else {
+        const old = next.find((img) => img.id === ev.id);
+        const merged = {
+          ...ev.data,
+          gesture_instances: old ? old.gesture_instances : [],
+        };
+        next = old
+          ? next.map((img) => (img.id === ev.id ? merged : img))
+          : [...rest, merged];
+      }
+    } else if (ev.entity === 'gesture_instance') {
+      const imageId = ev.data ? ev.data.image_id : ev.image_id;
+      next = next.map((img) => {
+        const others = (img.gesture_instances || []).filter(
+          (inst) => inst.id !== ev.id
+        );
+        if (img.id !== imageId || ev.op === 'delete' || !ev.data) {
+          return others.length === (img.gesture_instances || []).length
+            ? img
+            : { ...img, gesture_instances: others };
+        }
+        const exists = others.length !== (img.gesture_instances || []).length;
+        return {
+          ...img,
+          gesture_instances: exists
+            ? img.gesture_instances.map((inst) =>
+                inst.id === ev.id ? ev.data : inst
+              )
+            : [...others, ev.data],
+        };
+      });
+    }
+  }
+  return next;
+}
+
 function App() {
   const [images, setImages] = useState([]);
 
   /* ------------------------------------------------------------------ */
-  /* Fetch the image + gesture‑instance list from the report backend.   */
+  /* Fetch the image + gesture‑instance list once, then follow the      */
+  /* change feed and apply deltas instead of reloading everything.      */
   /* ------------------------------------------------------------------ */
   useEffect(() => {
+    let cancelled = false;
+
     const fetchImages = async () => {
-      try {
-        const res = await axios.get(
-          'http://35.176.15.104:5001/report/api/images'
-        );
-        setImages(res.data);
-      } catch (err) {
-        console.error('Error fetching images:', err);
+      // Read the feed version first so no change slips in between.
+      const feed = await axios.get(`${API_BASE}/report/api/changes`);
+      const res = await axios.get(`${API_BASE}/report/api/images`);
+      if (!cancelled) setImages(res.data);
+      return feed.data.version;
+    };
+
+    const followChanges = async () => {
+      let version = null;
+      while (!cancelled) {
+        try {
+          if (version === null) version = await fetchImages();
+          const res = await axios.get(`${API_BASE}/report/api/changes`, {
+            params: { since: version },
+          });
+          if (cancelled) break;
+          if (res.data.reset) {
+            version = null; // feed restarted; reload the full dataset
+            continue;
+          }
+          if (res.data.events.length > 0) {
+            setImages((prev) => applyChanges(prev, res.data.events));
+          }
+          version = res.data.version;
+        } catch (err) {
+          console.error('Error fetching changes:', err);
+          await new Promise((r) => setTimeout(r, 5000));
+        }
       }
     };
-    fetchImages();
+
+    followChanges();
+    return () => {
+      cancelled = true;
+    };
   }, []);
 
   /* Where each <img> should load from */
-  const getImageUrl = (filename) =>
-    `http://35.176.15.104:5001/uploads/${filename}`;
+  const getImageUrl = (filename) => `${API_BASE}/uploads/${filename}`;
 
   return (
     <div style={{ padding: 20, fontFamily: 'Arial, sans-serif' }}>